@@ -32,3 +32,100 @@ CREATE INDEX IF NOT EXISTS idx_eventos_estado ON eventos_transmision(estado);
 -- ✅ Backend valida el stream_key de la tabla users
 -- ✅ eventos_transmision guarda la url_transmision (kick, o tu servidor)
 -- ✅ hls_url guarda la URL de tu servidor Contabo cuando transmitas
+
+-- ============================================
+-- HISTORIAL Y ESTADÍSTICAS DE EVENTOS
+-- ============================================
+
+-- 4. Tamaño de la grabación subida a R2
+ALTER TABLE eventos_transmision
+ADD COLUMN IF NOT EXISTS video_url TEXT,
+ADD COLUMN IF NOT EXISTS video_size_bytes BIGINT;
+
+-- 5. Índice para paginación keyset del historial: (fecha_evento, id)
+CREATE INDEX IF NOT EXISTS idx_eventos_fecha_id
+ON eventos_transmision(fecha_evento DESC, id DESC);
+
+-- 6. Resumen por evento (se actualiza al detener el stream)
+CREATE TABLE IF NOT EXISTS eventos_resumen (
+    evento_id INTEGER PRIMARY KEY REFERENCES eventos_transmision(id) ON DELETE CASCADE,
+    mes DATE NOT NULL,
+    titulo VARCHAR(255),
+    fecha_evento TIMESTAMP,
+    fecha_fin_evento TIMESTAMP,
+    duracion_segundos INTEGER,
+    video_url TEXT,
+    video_size_bytes BIGINT,
+    viewer_count_max INTEGER DEFAULT 0,
+    total_views INTEGER DEFAULT 0,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_eventos_resumen_mes ON eventos_resumen(mes);
+
+-- 7. Resumen mensual (se recalcula solo el mes afectado desde eventos_resumen)
+CREATE TABLE IF NOT EXISTS eventos_resumen_mensual (
+    mes DATE PRIMARY KEY,
+    total_eventos INTEGER NOT NULL DEFAULT 0,
+    duracion_total_segundos BIGINT NOT NULL DEFAULT 0,
+    duracion_promedio_segundos INTEGER,
+    video_bytes_total BIGINT NOT NULL DEFAULT 0,
+    viewer_count_max INTEGER NOT NULL DEFAULT 0,
+    total_views BIGINT NOT NULL DEFAULT 0,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Para poblar los resúmenes con eventos ya finalizados:
+-- POST /api/admin/rebuild-rollups
+
+-- ============================================
+-- INGESTA IDEMPOTENTE DE GRABACIONES
+-- ============================================
+
+-- 8. Un registro por archivo que reporta nginx-rtmp (on_record_done)
+--    La clave única descarta callbacks repetidos sin transferir bytes
+CREATE TABLE IF NOT EXISTS grabaciones_ingesta (
+    id SERIAL PRIMARY KEY,
+    stream_key VARCHAR(255) NOT NULL,
+    ruta TEXT NOT NULL,
+    tamano_bytes BIGINT NOT NULL DEFAULT 0,
+    etag VARCHAR(255) NOT NULL DEFAULT '',
+    evento_id INTEGER REFERENCES eventos_transmision(id) ON DELETE SET NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente', -- sin_verificar | pendiente | transfiriendo | subido | error
+    r2_key TEXT NOT NULL,
+    error TEXT,
+    creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (stream_key, ruta, tamano_bytes, etag)
+);
+
+CREATE INDEX IF NOT EXISTS idx_grabaciones_evento ON grabaciones_ingesta(evento_id, ruta);
+
+-- 9. grabaciones_ingesta es también la cola de subidas a R2: los workers
+--    reclaman filas 'pendiente' con FOR UPDATE SKIP LOCKED y renuevan
+--    actualizado_en mientras transfieren (estado 'transfiriendo')
+ALTER TABLE grabaciones_ingesta
+ADD COLUMN IF NOT EXISTS prioridad INTEGER NOT NULL DEFAULT 5,
+ADD COLUMN IF NOT EXISTS intentos INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS bytes_transferidos BIGINT NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_grabaciones_cola ON grabaciones_ingesta(prioridad, id)
+WHERE estado = 'pendiente';
+
+-- 10. Presupuesto de ancho de banda del ingest, compartido por todos los workers
+--     (bytes concedidos por segundo epoch; el barrido borra los segundos viejos)
+CREATE TABLE IF NOT EXISTS ingest_ancho_banda (
+    segundo BIGINT PRIMARY KEY,
+    bytes BIGINT NOT NULL DEFAULT 0
+);
+
+-- 11. Fragmentos que no se pueden unir (p. ej. .mp4): el evento queda con
+--     video_url NULL y la lista [{"url", "size"}] de cada fragmento en orden
+ALTER TABLE eventos_transmision
+ADD COLUMN IF NOT EXISTS video_partes JSONB;
+
+-- 12. Intentos fallidos de unir los fragmentos del evento: el barrido deja de
+--     reintentar al llegar a INGEST_MAX_INTENTOS (para reintentar, volver a 0)
+ALTER TABLE eventos_transmision
+ADD COLUMN IF NOT EXISTS consolidacion_intentos INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS consolidacion_error TEXT;
@@ -6,6 +6,10 @@ import secrets
 import boto3
 from botocore.exceptions import ClientError
 from app.core.config import settings
+from app.services.cache_bus import cache_bus
+from app.services.hls_cache import hls_cache
+from app.services.rollup_service import rollup_service
+from app.services.ingest_scheduler import ingest_scheduler
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
@@ -53,6 +57,9 @@ async def generar_stream_key(
             "user_id": user_id
         }).fetchone()
 
+        # El stream_key anterior deja de ser válido en todos los workers
+        cache_bus.publicar(db, "stream_key", user_id=user_id)
+
         db.commit()
 
         print(f"✅ [ADMIN] Stream key generado para {email}")
@@ -126,11 +133,14 @@ async def obtener_stream_key(
 
 
 @router.get("/test-r2")
-async def test_cloudflare_r2():
+async def test_cloudflare_r2(upload: bool = False):
     """
     Testea la conexión a Cloudflare R2
 
     Uso: GET /api/admin/test-r2
+         GET /api/admin/test-r2?upload=true  (también sube un archivo de prueba)
+
+    Para monitoreo frecuente usar GET /health/ready, que no escribe en R2
     """
     try:
         print("🔍 [ADMIN] Testeando conexión a Cloudflare R2...")
@@ -180,18 +190,19 @@ async def test_cloudflare_r2():
         test_upload = False
         test_file_key = "test/connection-test.txt"
         test_url = None
-        try:
-            s3_client.put_object(
-                Bucket=settings.R2_BUCKET_NAME,
-                Key=test_file_key,
-                Body=b"Test de conexion desde backend - " + str(secrets.token_hex(8)).encode(),
-                ContentType='text/plain'
-            )
-            test_upload = True
-            test_url = f"{settings.R2_PUBLIC_URL}/{test_file_key}"
-            print(f"✅ [ADMIN] Archivo de prueba subido: {test_url}")
-        except ClientError as e:
-            print(f"❌ [ADMIN] Error subiendo archivo de prueba: {e}")
+        if upload:
+            try:
+                s3_client.put_object(
+                    Bucket=settings.R2_BUCKET_NAME,
+                    Key=test_file_key,
+                    Body=b"Test de conexion desde backend - " + str(secrets.token_hex(8)).encode(),
+                    ContentType='text/plain'
+                )
+                test_upload = True
+                test_url = f"{settings.R2_PUBLIC_URL}/{test_file_key}"
+                print(f"✅ [ADMIN] Archivo de prueba subido: {test_url}")
+            except ClientError as e:
+                print(f"❌ [ADMIN] Error subiendo archivo de prueba: {e}")
 
         return {
             "status": "ok",
@@ -223,3 +234,106 @@ async def test_cloudflare_r2():
             status_code=500,
             detail=f"Error conectando a Cloudflare R2: {str(e)}"
         )
+
+
+@router.get("/hls-cache")
+async def estado_hls_cache():
+    """
+    Estadísticas del origin shield HLS de este worker (hits, misses, bytes)
+
+    Uso: GET /api/admin/hls-cache
+    """
+    return {
+        "status": "ok",
+        "enabled": settings.HLS_SHIELD_ENABLED,
+        "cache": hls_cache.estado()
+    }
+
+
+@router.post("/rebuild-rollups")
+async def reconstruir_resumenes(db: Session = Depends(get_db)):
+    """
+    Recalcula eventos_resumen y eventos_resumen_mensual para todos los eventos finalizados
+
+    Solo para la carga inicial o tras corregir datos a mano; en operación
+    normal los resúmenes se actualizan al detener cada stream.
+
+    Uso: POST /api/admin/rebuild-rollups
+    """
+    try:
+        total = rollup_service.reconstruir(db)
+        db.commit()
+
+        print(f"✅ [ADMIN] Resúmenes reconstruidos para {total} eventos")
+
+        return {
+            "status": "ok",
+            "eventos_procesados": total
+        }
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ [ADMIN] Error reconstruyendo resúmenes: {e}")
+        raise HTTPException(status_code=500, detail=f"Error reconstruyendo resúmenes: {str(e)}")
+
+
+@router.get("/ingest")
+async def estado_ingest():
+    """
+    Estado de la cola de subidas de grabaciones a R2 (compartida por todos los workers)
+
+    Uso: GET /api/admin/ingest
+    """
+    try:
+        return {
+            "status": "ok",
+            **ingest_scheduler.estado()
+        }
+
+    except Exception as e:
+        print(f"❌ [ADMIN] Error consultando cola de ingest: {e}")
+        raise HTTPException(status_code=500, detail=f"Error consultando cola de ingest: {str(e)}")
+
+
+@router.post("/ingest/{grabacion_id}/prioridad")
+async def cambiar_prioridad_ingest(
+    grabacion_id: int,
+    prioridad: int,
+    db: Session = Depends(get_db)
+):
+    """
+    Cambia la prioridad de una grabación que aún no se sube (menor = antes)
+
+    Por defecto las grabaciones de un evento van con 5 y las sin-evento con 9.
+
+    Uso: POST /api/admin/ingest/123/prioridad?prioridad=1
+    """
+    try:
+        result = db.execute(text("""
+            UPDATE grabaciones_ingesta
+            SET prioridad = :prioridad
+            WHERE id = :grabacion_id AND estado IN ('sin_verificar', 'pendiente', 'error')
+            RETURNING id, ruta, estado, prioridad
+        """), {"grabacion_id": grabacion_id, "prioridad": prioridad}).fetchone()
+
+        if not result:
+            raise HTTPException(status_code=404, detail="Grabación no encontrada o ya en transferencia/subida")
+
+        db.commit()
+
+        print(f"🔀 [ADMIN] Grabación #{grabacion_id} ahora con prioridad {prioridad}")
+
+        return {
+            "status": "ok",
+            "grabacion_id": result[0],
+            "ruta": result[1],
+            "estado": result[2],
+            "prioridad": result[3]
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        print(f"❌ [ADMIN] Error cambiando prioridad: {e}")
+        raise HTTPException(status_code=500, detail=f"Error cambiando prioridad: {str(e)}")
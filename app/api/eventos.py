@@ -0,0 +1,189 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from app.core.database import get_db
+from sqlalchemy import text
+from typing import Optional
+from datetime import datetime
+import base64
+
+router = APIRouter(prefix="/api/eventos", tags=["eventos"])
+
+
+def _codificar_cursor(fecha_evento: datetime, evento_id: int) -> str:
+    valor = f"{fecha_evento.isoformat()}|{evento_id}"
+    return base64.urlsafe_b64encode(valor.encode()).decode()
+
+
+def _decodificar_cursor(cursor: str):
+    try:
+        fecha, evento_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(fecha), int(evento_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+@router.get("/historial")
+async def historial_eventos(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    estado: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Historial de eventos, del más reciente al más antiguo
+
+    Usa paginación keyset sobre (fecha_evento, id): cada página es un
+    index scan sobre idx_eventos_fecha_id sin importar qué tan atrás se vaya.
+
+    Uso: GET /api/eventos/historial?limit=20
+         GET /api/eventos/historial?cursor={next_cursor}
+    """
+    try:
+        filtros = ["e.fecha_evento IS NOT NULL"]
+        params = {"limit": limit + 1}
+
+        if cursor:
+            fecha_cursor, id_cursor = _decodificar_cursor(cursor)
+            filtros.append("(e.fecha_evento, e.id) < (:fecha_cursor, :id_cursor)")
+            params.update({"fecha_cursor": fecha_cursor, "id_cursor": id_cursor})
+
+        if estado:
+            filtros.append("e.estado = :estado")
+            params["estado"] = estado
+
+        query = text(f"""
+            SELECT
+                e.id,
+                e.titulo,
+                e.estado,
+                e.fecha_evento,
+                e.fecha_fin_evento,
+                CASE WHEN e.fecha_fin_evento IS NOT NULL
+                     THEN GREATEST(EXTRACT(EPOCH FROM e.fecha_fin_evento - e.fecha_evento), 0)::integer
+                END AS duracion_segundos,
+                e.video_url,
+                e.video_size_bytes,
+                e.viewer_count_max,
+                e.video_partes
+            FROM eventos_transmision e
+            WHERE {" AND ".join(filtros)}
+            ORDER BY e.fecha_evento DESC, e.id DESC
+            LIMIT :limit
+        """)
+
+        rows = db.execute(query, params).fetchall()
+
+        hay_mas = len(rows) > limit
+        rows = rows[:limit]
+
+        eventos = [
+            {
+                "id": row[0],
+                "titulo": row[1],
+                "estado": row[2],
+                "fecha_evento": row[3].isoformat(),
+                "fecha_fin_evento": row[4].isoformat() if row[4] else None,
+                "duracion_segundos": row[5],
+                "video_url": row[6],
+                "video_size_bytes": row[7],
+                "viewer_count_max": row[8],
+                "video_partes": row[9]
+            }
+            for row in rows
+        ]
+
+        return {
+            "eventos": eventos,
+            "next_cursor": _codificar_cursor(rows[-1][3], rows[-1][0]) if hay_mas else None
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ [HISTORIAL] Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Error obteniendo historial: {str(e)}")
+
+
+@router.get("/estadisticas/mensual")
+async def estadisticas_mensuales(
+    meses: int = Query(12, ge=1, le=120),
+    db: Session = Depends(get_db)
+):
+    """
+    Totales por mes, leídos de la tabla de resumen eventos_resumen_mensual
+
+    Uso: GET /api/eventos/estadisticas/mensual?meses=12
+    """
+    try:
+        query = text("""
+            SELECT
+                mes, total_eventos, duracion_total_segundos, duracion_promedio_segundos,
+                video_bytes_total, viewer_count_max, total_views
+            FROM eventos_resumen_mensual
+            ORDER BY mes DESC
+            LIMIT :meses
+        """)
+
+        rows = db.execute(query, {"meses": meses}).fetchall()
+
+        return {
+            "meses": [
+                {
+                    "mes": row[0].strftime("%Y-%m"),
+                    "total_eventos": row[1],
+                    "duracion_total_segundos": row[2],
+                    "duracion_promedio_segundos": row[3],
+                    "video_bytes_total": row[4],
+                    "viewer_count_max": row[5],
+                    "total_views": row[6]
+                }
+                for row in rows
+            ]
+        }
+
+    except Exception as e:
+        print(f"❌ [ESTADISTICAS] Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas: {str(e)}")
+
+
+@router.get("/{evento_id}/estadisticas")
+async def estadisticas_evento(
+    evento_id: int,
+    db: Session = Depends(get_db)
+):
+    """
+    Resumen de un evento finalizado (duración, grabación, pico de viewers)
+
+    Uso: GET /api/eventos/123/estadisticas
+    """
+    try:
+        query = text("""
+            SELECT
+                evento_id, titulo, fecha_evento, fecha_fin_evento, duracion_segundos,
+                video_url, video_size_bytes, viewer_count_max, total_views
+            FROM eventos_resumen
+            WHERE evento_id = :evento_id
+        """)
+
+        row = db.execute(query, {"evento_id": evento_id}).fetchone()
+
+        if not row:
+            raise HTTPException(status_code=404, detail="Evento sin resumen (aún no finaliza)")
+
+        return {
+            "evento_id": row[0],
+            "titulo": row[1],
+            "fecha_evento": row[2].isoformat() if row[2] else None,
+            "fecha_fin_evento": row[3].isoformat() if row[3] else None,
+            "duracion_segundos": row[4],
+            "video_url": row[5],
+            "video_size_bytes": row[6],
+            "viewer_count_max": row[7],
+            "total_views": row[8]
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ [ESTADISTICAS] Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas: {str(e)}")
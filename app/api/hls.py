@@ -0,0 +1,43 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
+import re
+from app.services.hls_cache import hls_cache, OrigenError, CONTENT_TYPES
+
+router = APIRouter(prefix="/hls", tags=["hls"])
+
+# Solo nombres simples (admite subcarpetas), nada de ".." ni rutas absolutas
+RUTA_VALIDA = re.compile(r"^[A-Za-z0-9_\-]+(/[A-Za-z0-9_\-]+)*\.[A-Za-z0-9]+$")
+
+
+@router.get("/{ruta:path}")
+async def servir_hls(ruta: str):
+    """
+    Sirve playlists y segmentos HLS cacheados desde el VPS Contabo
+
+    Con HLS_SHIELD_PUBLIC_URL apuntando a esta ruta, los viewers piden
+    aquí y Contabo entrega cada objeto aprox. una vez por worker.
+
+    Uso: GET /hls/stream.m3u8
+    """
+    extension = "." + ruta.rsplit(".", 1)[-1].lower()
+    if not RUTA_VALIDA.match(ruta) or extension not in CONTENT_TYPES:
+        raise HTTPException(status_code=404, detail="Recurso HLS no encontrado")
+
+    try:
+        contenido, content_type, estado_cache = await hls_cache.obtener(ruta)
+    except OrigenError as e:
+        print(f"❌ [HLS] {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    # Los segmentos no cambian una vez publicados; la playlist sí
+    if hls_cache.es_playlist(ruta):
+        cache_control = f"public, max-age={max(int(hls_cache.ttl_playlist), 1)}"
+    else:
+        cache_control = "public, max-age=3600, immutable"
+
+    # Se entrega el mismo objeto bytes del cache, sin copiarlo
+    return Response(
+        content=contenido,
+        media_type=content_type,
+        headers={"Cache-Control": cache_control, "X-Cache": estado_cache}
+    )
@@ -2,14 +2,49 @@ from fastapi import APIRouter, Depends, HTTPException, Form
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.config import settings
+from app.services.cache_bus import cache_bus
+from app.services.rollup_service import rollup_service
+from app.services.grabaciones_service import grabaciones_service
 from sqlalchemy import text
-import boto3
 from botocore.exceptions import ClientError
-import os
-from datetime import datetime
+import asyncio
 
 router = APIRouter(prefix="/api/streams", tags=["streams"])
 
+
+def _obtener_usuario_por_stream_key(db: Session, stream_key: str):
+    """
+    Busca el usuario dueño de un stream_key, usando el cache local del worker
+
+    Retorna un dict con id, email, es_admin e is_active, o None si no existe
+    """
+    usuario = cache_bus.stream_keys.obtener(stream_key)
+    if usuario is not None:
+        return usuario
+
+    generacion = cache_bus.stream_keys.generacion()
+
+    query = text("""
+        SELECT id, email, es_admin, is_active
+        FROM users
+        WHERE stream_key = :stream_key
+    """)
+
+    result = db.execute(query, {"stream_key": stream_key}).fetchone()
+
+    if not result:
+        return None
+
+    usuario = {
+        "id": result[0],
+        "email": result[1],
+        "es_admin": result[2],
+        "is_active": result[3]
+    }
+    cache_bus.stream_keys.guardar(stream_key, usuario, generacion)
+    return usuario
+
+
 @router.post("/validate")
 async def validar_stream_key(
     name: str = Form(...),  # nginx-rtmp envía el stream_key como "name"
@@ -25,20 +60,17 @@ async def validar_stream_key(
 
     try:
         # Consultar si existe un usuario admin con ese stream_key
-        query = text("""
-            SELECT id, email, es_admin, is_active
-            FROM users
-            WHERE stream_key = :stream_key
-        """)
+        usuario = _obtener_usuario_por_stream_key(db, name)
 
-        result = db.execute(query, {"stream_key": name}).fetchone()
-
-        if not result:
+        if not usuario:
             print(f"❌ [VALIDATE] Stream_key no encontrado")
             raise HTTPException(status_code=403, detail="Stream key inválido")
 
         # Verificar que sea admin y esté activo
-        user_id, email, es_admin, is_active = result
+        user_id = usuario["id"]
+        email = usuario["email"]
+        es_admin = usuario["es_admin"]
+        is_active = usuario["is_active"]
 
         if not es_admin:
             print(f"❌ [VALIDATE] Usuario {email} no es admin")
@@ -71,6 +103,12 @@ async def obtener_stream_en_vivo(db: Session = Depends(get_db)):
     Tu app Flutter llama este endpoint para obtener la URL del HLS
     """
     try:
+        cacheado = cache_bus.live.obtener("actual")
+        if cacheado is not None:
+            return cacheado
+
+        generacion = cache_bus.live.generacion()
+
         query = text("""
             SELECT
                 e.id,
@@ -90,17 +128,19 @@ async def obtener_stream_en_vivo(db: Session = Depends(get_db)):
         result = db.execute(query).fetchone()
 
         if not result:
-            return {
+            respuesta = {
                 "is_live": False,
                 "message": "No hay transmisión en vivo actualmente"
             }
+            cache_bus.live.guardar("actual", respuesta, generacion)
+            return respuesta
 
         evento_id, titulo, descripcion, thumbnail_url, estado, fecha_evento, admin_email = result
 
         # URL del HLS en tu servidor Contabo
-        hls_url = f"{settings.HLS_BASE_URL}/stream.m3u8"
+        hls_url = f"{settings.get_hls_public_url()}/stream.m3u8"
 
-        return {
+        respuesta = {
             "is_live": True,
             "evento": {
                 "id": evento_id,
@@ -112,6 +152,8 @@ async def obtener_stream_en_vivo(db: Session = Depends(get_db)):
                 "admin": admin_email
             }
         }
+        cache_bus.live.guardar("actual", respuesta, generacion)
+        return respuesta
 
     except Exception as e:
         print(f"❌ [LIVE] Error: {e}")
@@ -137,7 +179,7 @@ async def iniciar_stream(
             RETURNING id, titulo
         """)
 
-        hls_url = f"{settings.HLS_BASE_URL}/stream.m3u8"
+        hls_url = f"{settings.get_hls_public_url()}/stream.m3u8"
 
         result = db.execute(query, {
             "evento_id": evento_id,
@@ -147,6 +189,9 @@ async def iniciar_stream(
         if not result:
             raise HTTPException(status_code=404, detail="Evento no encontrado")
 
+        # Invalida /live en todos los workers al hacer commit
+        cache_bus.publicar(db, "live", evento_id=evento_id)
+
         db.commit()
 
         print(f"🔴 [START] Stream iniciado para evento #{evento_id}: {result[1]}")
@@ -190,10 +235,19 @@ async def detener_stream(
         if not result:
             raise HTTPException(status_code=404, detail="Evento no encontrado")
 
+        # Resumen del evento y de su mes, en la misma transacción
+        rollup_service.refrescar_evento(db, evento_id)
+
+        # Invalida /live en todos los workers al hacer commit
+        cache_bus.publicar(db, "live", evento_id=evento_id)
+
         db.commit()
 
         print(f"⏹️ [STOP] Stream finalizado para evento #{evento_id}: {result[1]}")
 
+        # Si las grabaciones ya llegaron a R2, enlazarlas al evento
+        grabaciones_service.programar_consolidacion(evento_id)
+
         return {
             "status": "ok",
             "evento_id": result[0],
@@ -222,95 +276,39 @@ async def upload_recording(
 
     Flujo:
     1. Recibe notificación de nginx cuando termina grabación
-    2. Descarga video del VPS Contabo (vía HTTP)
-    3. Sube video a Cloudflare R2
-    4. Actualiza eventos_transmision.video_url con URL pública
-    5. Marca evento como "finalizado"
+    2. Guarda el callback y verifica el archivo en Contabo (tamaño, etag); si
+       ya existe responde "duplicate" sin transferir nada. Si Contabo no
+       responde, responde "accepted" y el barrido reintenta la verificación
+    3. Encola la grabación en el ingest scheduler y responde de inmediato
+       (prioridad según si pertenece a un evento; el admin la puede cambiar)
+    4. El scheduler descarga el video de Contabo y lo sube a R2 en streaming,
+       con el ancho de banda limitado mientras haya un evento en vivo
+    5. Con el evento finalizado y todos sus fragmentos subidos, se unen en R2
+       y se actualiza eventos_transmision.video_url
+
+    Estado de la cola: GET /api/admin/ingest
     """
-    print(f"📹 [UPLOAD] Iniciando upload de grabación: {path}")
+    print(f"📹 [UPLOAD] Grabación recibida: {path}")
     print(f"📹 [UPLOAD] Stream_key: {name[:20]}...")
 
     try:
-        # 1. Generar nombre único para el video
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        filename = f"streams/{name[:16]}-{timestamp}.mp4"
-
-        # 2. Obtener usuario por stream_key
-        user_query = text("""
-            SELECT id, email FROM users
-            WHERE stream_key = :stream_key
-        """)
-        user = db.execute(user_query, {"stream_key": name}).fetchone()
+        # Obtener usuario por stream_key
+        user = _obtener_usuario_por_stream_key(db, name)
 
         if not user:
             print(f"⚠️ [UPLOAD] Stream_key no encontrado, grabación guardada pero no asociada")
             return {"status": "warning", "message": "Stream_key no encontrado"}
 
-        user_id, user_email = user
+        user_email = user["email"]
         print(f"📹 [UPLOAD] Usuario encontrado: {user_email}")
 
-        # 3. OPCIÓN A: Si nginx-rtmp está en el MISMO servidor que Backend
-        # Lee el archivo directamente del filesystem
-        # video_data = open(path, 'rb').read()
-
-        # 3. OPCIÓN B: nginx-rtmp está en Contabo VPS (diferente servidor)
-        # Descarga el video vía HTTP desde Contabo
-        import requests
-
-        # Construir URL pública del archivo grabado
-        # path = /var/www/recordings/stream-20250103-194530.mp4
-        # URL = http://185.188.249.229/recordings/stream-20250103-194530.mp4
-        filename_only = os.path.basename(path)
-        video_url_contabo = f"http://{settings.CONTABO_IP}/recordings/{filename_only}"
-
-        print(f"📹 [UPLOAD] Descargando video desde Contabo: {video_url_contabo}")
-
-        response = requests.get(video_url_contabo, timeout=300)  # 5 min timeout
-
-        if response.status_code != 200:
-            raise Exception(f"Error descargando video de Contabo: HTTP {response.status_code}")
-
-        video_data = response.content
-        video_size_mb = len(video_data) / (1024 * 1024)
-        print(f"📹 [UPLOAD] Video descargado: {video_size_mb:.2f} MB")
-
-        # 4. Subir a Cloudflare R2
-        print(f"☁️ [UPLOAD] Subiendo a R2: {filename}")
-
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=settings.R2_ENDPOINT,
-            aws_access_key_id=settings.R2_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.R2_SECRET_ACCESS_KEY,
-            region_name='auto'
-        )
-
-        s3_client.put_object(
-            Bucket=settings.R2_BUCKET_NAME,
-            Key=filename,
-            Body=video_data,
-            ContentType='video/mp4'
-        )
-
-        # 5. URL pública del video
-        public_url = f"{settings.R2_PUBLIC_URL}/{filename}"
-        print(f"✅ [UPLOAD] Video subido a R2: {public_url}")
-
-        # 6. Solo subir a R2, no actualizar BD (por ahora)
-        print(f"✅ [UPLOAD] Video guardado en R2, no se actualiza BD")
-
-        return {
-            "status": "ok",
-            "message": "Video subido exitosamente a R2",
-            "video_url": public_url,
-            "video_size_mb": round(video_size_mb, 2),
-            "user_email": user_email
-        }
+        # El HEAD a Contabo bloquea: fuera del event loop para no frenar /hls en este worker
+        return await asyncio.to_thread(grabaciones_service.registrar, db, path, name, user["id"], user_email)
 
     except Exception as e:
         db.rollback()
-        print(f"❌ [UPLOAD] Error subiendo grabación: {e}")
+        print(f"❌ [UPLOAD] Error encolando grabación: {e}")
         raise HTTPException(
             status_code=500,
-            detail=f"Error subiendo grabación: {str(e)}"
+            detail=f"Error encolando grabación: {str(e)}"
         )
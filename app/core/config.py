@@ -21,6 +21,33 @@ class Settings(BaseSettings):
     CONTABO_IP: str
     HLS_BASE_URL: str
 
+    # Origin shield HLS (opcional): cachea playlists y segmentos de Contabo
+    HLS_SHIELD_ENABLED: bool = False
+    HLS_SHIELD_PUBLIC_URL: str = ""  # ej: https://backend.railway.app/hls
+    HLS_PLAYLIST_TTL_SECONDS: float = 2.0
+    HLS_SEGMENT_CACHE_MB: int = 256
+
+    # Cache local + bus de invalidación (Postgres LISTEN/NOTIFY)
+    CACHE_BUS_CHANNEL: str = "gallos_cache"
+    CACHE_TTL_SECONDS: int = 30
+
+    # Health checks en segundo plano
+    HEALTH_PROBE_INTERVAL_SECONDS: int = 15
+    HEALTH_PROBE_TIMEOUT_SECONDS: int = 3
+
+    # Ingest de grabaciones Contabo -> R2 (bytes/seg totales entre todos los workers, 0 = sin límite)
+    INGEST_MAX_BYTES_PER_SEC: int = 0
+    INGEST_LIVE_BYTES_PER_SEC: int = 2 * 1024 * 1024
+    INGEST_MAX_CONCURRENT: int = 2  # Transferencias simultáneas por worker
+    INGEST_STALE_MINUTES: int = 5  # Sin latidos por este tiempo, la transferencia vuelve a la cola
+    INGEST_MAX_INTENTOS: int = 5  # Reintentos automáticos de una grabación que falló
+    INGEST_RETRY_MINUTES: int = 10  # Espera entre reintentos
+    INGEST_EVENTO_MARGEN_MINUTES: int = 30  # Margen antes/después del evento al asignar grabaciones
+    # Formatos que se pueden unir concatenando bytes. nginx-rtmp `record` escribe .flv
+    # (cada archivo con su propio header), así que por defecto sus fragmentos no se
+    # unen y el evento queda con video_partes
+    INGEST_STITCH_EXTENSIONS: str = ".ts"
+
     # CORS
     ALLOWED_ORIGINS: str = '["*"]'
 
@@ -38,4 +65,14 @@ class Settings(BaseSettings):
         except:
             return ["*"]
 
+    def get_stitch_extensions(self) -> List[str]:
+        """Parse INGEST_STITCH_EXTENSIONS (ej: ".ts,.mpg")"""
+        return [e.strip().lower() for e in self.INGEST_STITCH_EXTENSIONS.split(",") if e.strip()]
+
+    def get_hls_public_url(self) -> str:
+        """URL base del HLS para los viewers: el shield si está activo, si no Contabo"""
+        if self.HLS_SHIELD_ENABLED and self.HLS_SHIELD_PUBLIC_URL:
+            return self.HLS_SHIELD_PUBLIC_URL.rstrip("/")
+        return self.HLS_BASE_URL
+
 settings = Settings()
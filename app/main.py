@@ -1,7 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.core.config import settings
-from app.api import streams, admin
+from app.api import streams, admin, hls, eventos
+from app.services.cache_bus import cache_bus
+from app.services.health_service import health_service
+from app.services.ingest_scheduler import ingest_scheduler
 
 app = FastAPI(
     title="Gallos Streaming Server",
@@ -21,6 +25,23 @@ app.add_middleware(
 # Routers
 app.include_router(streams.router)
 app.include_router(admin.router)
+app.include_router(eventos.router)
+if settings.HLS_SHIELD_ENABLED:
+    app.include_router(hls.router)
+
+@app.on_event("startup")
+async def startup():
+    # Cada worker escucha las invalidaciones de cache de los demás
+    cache_bus.iniciar()
+    health_service.iniciar()
+    ingest_scheduler.iniciar()
+
+@app.on_event("shutdown")
+async def shutdown():
+    cache_bus.detener()
+    health_service.detener()
+    # Devuelve a la cola las grabaciones en curso para que otro worker las retome
+    ingest_scheduler.detener()
 
 @app.get("/")
 async def root():
@@ -31,7 +52,9 @@ async def root():
             "validate_stream": "POST /api/streams/validate",
             "get_live_stream": "GET /api/streams/live",
             "start_stream": "POST /api/streams/start",
-            "stop_stream": "POST /api/streams/stop"
+            "stop_stream": "POST /api/streams/stop",
+            "event_history": "GET /api/eventos/historial",
+            "readiness": "GET /health/ready"
         }
     }
 
@@ -46,6 +69,18 @@ async def health_check():
         "railway_deployed": True
     }
 
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Estado de BD, R2 y Contabo según el último chequeo en segundo plano
+
+    No hace llamadas de red: responde 503 si el estado es "down" para que
+    el balanceador saque este worker de rotación
+    """
+    estado = health_service.estado()
+    status_code = 503 if estado["status"] == "down" else 200
+    return JSONResponse(status_code=status_code, content=estado)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8004, reload=True)
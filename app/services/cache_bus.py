@@ -0,0 +1,170 @@
+import json
+import select
+import threading
+import time
+from typing import Any, Callable, Optional
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import engine
+
+
+class CacheLocal:
+    """
+    Cache en memoria del proceso, con TTL como red de seguridad
+
+    Cada invalidación incrementa la generación. El caller lee generacion()
+    antes de consultar la BD y la pasa a guardar(): si hubo una invalidación
+    entre medio, el valor leído puede ser viejo y no se guarda.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.activo = False
+        self._datos = {}
+        self._generacion = 0
+        self._lock = threading.Lock()
+
+    def generacion(self) -> int:
+        with self._lock:
+            return self._generacion
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        """Devuelve el valor cacheado o None si no existe, expiró o el cache está inactivo"""
+        if not self.activo:
+            return None
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            return valor
+
+    def guardar(self, clave: str, valor: Any, generacion: int):
+        """Guarda el valor solo si no hubo invalidaciones desde `generacion`"""
+        if not self.activo:
+            return
+        with self._lock:
+            if generacion != self._generacion:
+                return
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+
+    def eliminar_si(self, condicion: Callable[[str, Any], bool]):
+        """Elimina las entradas para las que condicion(clave, valor) es True"""
+        with self._lock:
+            for clave in [c for c, (_, v) in self._datos.items() if condicion(c, v)]:
+                del self._datos[clave]
+            self._generacion += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self._generacion += 1
+
+
+class CacheBus:
+    """
+    Bus de invalidación entre workers usando Postgres LISTEN/NOTIFY
+
+    Cada proceso mantiene una conexión dedicada escuchando el canal
+    CACHE_BUS_CHANNEL. Las mutaciones (/start, /stop, generate-stream-key)
+    publican un NOTIFY dentro de su transacción, así que solo se entrega
+    si hacen commit. Mientras la conexión LISTEN está caída los caches se
+    desactivan y todo se lee de la BD.
+    """
+
+    def __init__(self):
+        self.canal = settings.CACHE_BUS_CHANNEL
+        self.live = CacheLocal(settings.CACHE_TTL_SECONDS)
+        self.stream_keys = CacheLocal(settings.CACHE_TTL_SECONDS)
+        self.conectado = False
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        """Arranca el hilo que escucha el canal de invalidación"""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._escuchar, name="cache-bus", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def publicar(self, db: Session, evento: str, **datos):
+        """
+        Publica una invalidación en la transacción actual de `db`
+
+        Postgres entrega el NOTIFY al hacer commit (y lo descarta en rollback).
+        La invalidación también se aplica de inmediato en este proceso.
+        """
+        payload = json.dumps({"evento": evento, **datos}, default=str)
+        db.execute(text("SELECT pg_notify(:canal, :payload)"), {
+            "canal": self.canal,
+            "payload": payload
+        })
+        self._aplicar(evento, datos)
+
+    def _aplicar(self, evento: str, datos: dict):
+        if evento == "live":
+            self.live.limpiar()
+        elif evento == "stream_key":
+            user_id = str(datos.get("user_id"))
+            self.stream_keys.eliminar_si(lambda clave, valor: str(valor["id"]) == user_id)
+        else:
+            print(f"⚠️ [CACHE] Evento de invalidación desconocido: {evento}")
+
+    def _activar_caches(self, activo: bool):
+        for cache in (self.live, self.stream_keys):
+            cache.activo = activo
+            cache.limpiar()
+
+    def _escuchar(self):
+        while not self._detener.is_set():
+            conexion = None
+            try:
+                conexion = engine.raw_connection()
+                conexion.detach()  # Conexión dedicada, fuera del pool
+                pg = conexion.driver_connection
+                pg.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with pg.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.canal}"')
+
+                # Lo cacheado antes de conectar pudo perder notificaciones
+                self._activar_caches(True)
+                self.conectado = True
+                print(f"✅ [CACHE] Escuchando invalidaciones en canal '{self.canal}'")
+
+                while not self._detener.is_set():
+                    if select.select([pg], [], [], 5) == ([], [], []):
+                        continue
+                    pg.poll()
+                    while pg.notifies:
+                        notificacion = pg.notifies.pop(0)
+                        try:
+                            datos = json.loads(notificacion.payload)
+                            self._aplicar(datos.pop("evento", ""), datos)
+                        except ValueError:
+                            print(f"⚠️ [CACHE] Payload inválido: {notificacion.payload}")
+
+            except Exception as e:
+                print(f"❌ [CACHE] Conexión LISTEN perdida: {e}")
+            finally:
+                self.conectado = False
+                self._activar_caches(False)
+                if conexion is not None:
+                    try:
+                        conexion.close()
+                    except Exception:
+                        pass
+
+            self._detener.wait(5)
+
+
+# Singleton
+cache_bus = CacheBus()
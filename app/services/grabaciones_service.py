@@ -0,0 +1,575 @@
+import json
+import math
+import os
+import re
+import threading
+import requests
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+from app.services.ingest_scheduler import ingest_scheduler, CONTENT_TYPES
+from app.services.rollup_service import rollup_service
+
+# Límites de multipart de S3/R2 para upload_part_copy
+MIN_PART_BYTES = 5 * 1024 * 1024
+MAX_PART_BYTES = 5 * 1024 * 1024 * 1024
+MAX_PARTES = 10000
+
+# Prioridad en la cola de ingest (menor = antes); se cambia con POST /api/admin/ingest/{id}/prioridad
+PRIORIDAD_EVENTO = 5
+PRIORIDAD_SIN_EVENTO = 9
+
+# Con `record_unique on` nginx-rtmp agrega el epoch al nombre: stream-1735933530.flv
+EPOCH_EN_NOMBRE = re.compile(r"-(\d{10})(?:\.\w+)?$")
+
+
+class GrabacionesService:
+    """
+    Ingesta idempotente de grabaciones y unión de fragmentos por evento
+
+    Cada archivo que reporta nginx-rtmp queda registrado en grabaciones_ingesta
+    con clave única (stream_key, ruta, tamaño, etag). Si on_record_done llega
+    repetido, el INSERT choca y no se transfiere nada. Cuando el evento está
+    finalizado y todos sus fragmentos están en R2, se unen en un solo objeto
+    con upload_part_copy (copia del lado de R2, sin volver a descargar) y se
+    actualiza eventos_transmision.video_url.
+    """
+
+    def __init__(self):
+        ingest_scheduler.al_completar = self._al_subir
+        ingest_scheduler.al_barrer = self._al_barrer
+        self._barrido_lock = threading.Lock()
+
+    def _momento_grabacion(self, filename: str):
+        """Epoch de la grabación si viene en el nombre; None = usar la hora del callback"""
+        # El sufijo -%Y%m%d-%H%M%S está en la hora local del VPS, por eso no se usa
+        coincidencia = EPOCH_EN_NOMBRE.search(filename)
+        return int(coincidencia.group(1)) if coincidencia else None
+
+    def registrar(self, db: Session, path: str, stream_key: str, user_id, user_email: str) -> dict:
+        """
+        Registra una grabación en la cola de ingest, o la descarta si ya fue ingerida
+
+        Primero guarda el callback (estado 'sin_verificar') y recién después
+        consulta a Contabo: nginx-rtmp no reintenta on_record_done, así que si
+        el HEAD falla la fila queda y el barrido la vuelve a verificar.
+        Hace commit de `db`. Retorna la respuesta para nginx-rtmp.
+        """
+        filename_only = os.path.basename(path)
+
+        # El evento del admin cuya ventana [inicio, fin] (con margen) contiene la
+        # grabación. on_record_done llega al cerrar el archivo, así que sin epoch
+        # en el nombre la hora del callback cae dentro del evento grabado.
+        evento_id = db.execute(text("""
+            SELECT id FROM eventos_transmision
+            WHERE admin_creador_id = :user_id
+              AND estado IN ('en_vivo', 'finalizado')
+              AND fecha_evento - make_interval(mins => :margen_min)
+                  <= COALESCE(to_timestamp(CAST(:epoch AS bigint))::timestamp, NOW())
+              AND COALESCE(to_timestamp(CAST(:epoch AS bigint))::timestamp, NOW())
+                  <= COALESCE(fecha_fin_evento, NOW()) + make_interval(mins => :margen_min)
+            ORDER BY (estado = 'en_vivo') DESC, fecha_evento DESC, id DESC
+            LIMIT 1
+        """), {
+            "user_id": user_id,
+            "epoch": self._momento_grabacion(filename_only),
+            "margen_min": settings.INGEST_EVENTO_MARGEN_MINUTES
+        }).scalar()
+
+        if not evento_id:
+            print(f"⚠️ [UPLOAD] Ningún evento del admin #{user_id} coincide con {filename_only}, va a sin-evento")
+
+        # Las grabaciones de un evento (las que se ven en el historial) pasan primero
+        prioridad = PRIORIDAD_EVENTO if evento_id else PRIORIDAD_SIN_EVENTO
+        carpeta = evento_id if evento_id else "sin-evento"
+        r2_key = f"streams/{stream_key[:16]}/{carpeta}/{filename_only}"
+
+        # Tamaño y etag se completan al verificar; un callback repetido antes de
+        # eso choca con esta misma fila y solo reinicia sus reintentos
+        grabacion_id = db.execute(text("""
+            INSERT INTO grabaciones_ingesta (stream_key, ruta, evento_id, r2_key, prioridad, estado)
+            VALUES (:stream_key, :ruta, :evento_id, :r2_key, :prioridad, 'sin_verificar')
+            ON CONFLICT (stream_key, ruta, tamano_bytes, etag) DO UPDATE
+                SET intentos = 0,
+                    actualizado_en = NOW()
+                WHERE grabaciones_ingesta.estado = 'sin_verificar'
+            RETURNING id
+        """), {
+            "stream_key": stream_key,
+            "ruta": path,
+            "evento_id": evento_id,
+            "r2_key": r2_key,
+            "prioridad": prioridad
+        }).scalar()
+
+        db.commit()
+
+        estado, grabacion_id = self._verificar(db, grabacion_id) if grabacion_id else ("duplicate", None)
+
+        mensajes = {
+            "queued": "Grabación en cola para subir a R2",
+            "duplicate": "Grabación ya ingerida o en proceso",
+            "accepted": "Grabación registrada; se verificará en Contabo en segundo plano"
+        }
+        return {
+            "status": estado,
+            "message": mensajes[estado],
+            "grabacion_id": grabacion_id,
+            "evento_id": evento_id,
+            "user_email": user_email
+        }
+
+    def _verificar(self, db: Session, grabacion_id: int) -> tuple:
+        """
+        Completa tamaño y etag de una fila 'sin_verificar' con un HEAD a Contabo
+
+        Con esos datos la fila pasa a la cola, o se descarta si el mismo
+        archivo ya estaba registrado (un intento fallido se vuelve a encolar).
+        Hace commit de `db`. Retorna (status, grabacion_id).
+        """
+        fila = db.execute(text("""
+            SELECT stream_key, ruta, prioridad
+            FROM grabaciones_ingesta
+            WHERE id = :id AND estado = 'sin_verificar'
+        """), {"id": grabacion_id}).fetchone()
+        db.commit()
+
+        if not fila:
+            return "duplicate", None  # Otro worker ya la verificó
+        stream_key, ruta, prioridad = fila
+
+        # Solo un HEAD: tamaño y etag identifican el archivo sin descargarlo
+        video_url_contabo = f"http://{settings.CONTABO_IP}/recordings/{os.path.basename(ruta)}"
+        try:
+            response = requests.head(video_url_contabo, timeout=10)
+            if response.status_code != 200:
+                raise Exception(f"Grabación no disponible en Contabo: HTTP {response.status_code}")
+        except Exception as e:
+            print(f"⚠️ [UPLOAD] #{grabacion_id} no se pudo verificar, se reintentará: {e}")
+            db.execute(text("""
+                UPDATE grabaciones_ingesta
+                SET intentos = intentos + 1, error = :error, actualizado_en = NOW()
+                WHERE id = :id AND estado = 'sin_verificar'
+            """), {"id": grabacion_id, "error": str(e)})
+            db.commit()
+            return "accepted", grabacion_id
+
+        tamano_bytes = int(response.headers.get("Content-Length") or 0)
+        etag = response.headers.get("ETag", "").strip('"')
+
+        try:
+            existente = db.execute(text("""
+                SELECT id, estado FROM grabaciones_ingesta
+                WHERE stream_key = :stream_key AND ruta = :ruta
+                  AND tamano_bytes = :tamano_bytes AND etag = :etag
+                  AND id <> :id
+                FOR UPDATE
+            """), {
+                "id": grabacion_id,
+                "stream_key": stream_key,
+                "ruta": ruta,
+                "tamano_bytes": tamano_bytes,
+                "etag": etag
+            }).fetchone()
+
+            if existente:
+                db.execute(text("""
+                    DELETE FROM grabaciones_ingesta WHERE id = :id AND estado = 'sin_verificar'
+                """), {"id": grabacion_id})
+
+                # Solo se vuelve a encolar un intento fallido: si la grabación
+                # está en cola o transfiriéndose, el callback repetido se ignora
+                if existente[1] != "error":
+                    db.commit()
+                    print(f"♻️ [UPLOAD] Grabación ya registrada (#{existente[0]}), se ignora: {ruta}")
+                    return "duplicate", existente[0]
+
+                db.execute(text("""
+                    UPDATE grabaciones_ingesta
+                    SET estado = 'pendiente', error = NULL, actualizado_en = NOW()
+                    WHERE id = :id
+                """), {"id": existente[0]})
+                grabacion_id = existente[0]
+            else:
+                actualizada = db.execute(text("""
+                    UPDATE grabaciones_ingesta
+                    SET tamano_bytes = :tamano_bytes,
+                        etag = :etag,
+                        estado = 'pendiente',
+                        intentos = 0,
+                        error = NULL,
+                        actualizado_en = NOW()
+                    WHERE id = :id AND estado = 'sin_verificar'
+                """), {"id": grabacion_id, "tamano_bytes": tamano_bytes, "etag": etag}).rowcount
+                if not actualizada:
+                    db.rollback()
+                    return "duplicate", None
+
+            db.commit()
+
+        except IntegrityError:
+            # Otro callback del mismo archivo se verificó en paralelo y ganó
+            db.rollback()
+            db.execute(text("""
+                DELETE FROM grabaciones_ingesta WHERE id = :id AND estado = 'sin_verificar'
+            """), {"id": grabacion_id})
+            db.commit()
+            print(f"♻️ [UPLOAD] Grabación ya registrada, se ignora: {ruta}")
+            return "duplicate", None
+
+        # La fila ya es el trabajo: cualquier worker libre la reclama
+        ingest_scheduler.despertar()
+        print(f"📥 [UPLOAD] Grabación #{grabacion_id} en cola (prioridad {prioridad}): {ruta}")
+        return "queued", grabacion_id
+
+    def verificar_pendientes(self, limite: int = 50):
+        """
+        Lo llama el barrido: reintenta el HEAD de las grabaciones 'sin_verificar'
+
+        Espera INGEST_RETRY_MINUTES entre intentos y se rinde tras
+        INGEST_MAX_INTENTOS (un nuevo callback del mismo archivo reinicia la cuenta).
+        """
+        db = SessionLocal()
+        try:
+            ids = db.execute(text("""
+                SELECT id FROM grabaciones_ingesta
+                WHERE estado = 'sin_verificar'
+                  AND intentos < :max_intentos
+                  AND actualizado_en < NOW() - make_interval(mins => :retry_min)
+                ORDER BY id
+                LIMIT :limite
+            """), {
+                "max_intentos": settings.INGEST_MAX_INTENTOS,
+                "retry_min": settings.INGEST_RETRY_MINUTES,
+                "limite": limite
+            }).scalars().all()
+            db.commit()
+
+            for grabacion_id in ids:
+                try:
+                    self._verificar(db, grabacion_id)
+                except Exception as e:
+                    db.rollback()
+                    print(f"❌ [UPLOAD] Error verificando grabación #{grabacion_id}: {e}")
+        finally:
+            db.close()
+
+    def _al_subir(self, trabajo):
+        """Hook del scheduler: con el fragmento ya en R2, intenta consolidar su evento"""
+        # En otro hilo, para no ocupar el cupo de transferencias durante la copia
+        if trabajo.evento_id:
+            self.programar_consolidacion(trabajo.evento_id)
+
+    def _al_barrer(self):
+        """Hook del barrido: verifica y consolida en otro hilo para no frenar la recuperación de la cola"""
+        if not self._barrido_lock.acquire(blocking=False):
+            return  # El barrido anterior sigue consolidando
+        threading.Thread(target=self._barrer_y_liberar, name="grabaciones-barrido", daemon=True).start()
+
+    def _barrer_y_liberar(self):
+        try:
+            self.verificar_pendientes()
+            self.consolidar_pendientes()
+        except Exception as e:
+            print(f"❌ [UPLOAD] Error en el barrido de grabaciones: {e}")
+        finally:
+            self._barrido_lock.release()
+
+    def programar_consolidacion(self, evento_id: int):
+        """Intenta consolidar el video del evento en segundo plano (p. ej. tras /stop)"""
+        threading.Thread(
+            target=self.consolidar_evento,
+            args=(evento_id,),
+            name=f"consolidar-{evento_id}",
+            daemon=True
+        ).start()
+
+    def consolidar_pendientes(self, limite: int = 20):
+        """
+        Lo llama el barrido: reintenta eventos finalizados que quedaron sin video
+
+        Cubre consolidaciones que fallaron o que se cortaron con un redeploy.
+        """
+        db = SessionLocal()
+        try:
+            eventos = db.execute(text("""
+                SELECT e.id
+                FROM eventos_transmision e
+                WHERE e.estado = 'finalizado'
+                  AND e.video_url IS NULL
+                  AND e.video_partes IS NULL
+                  AND e.consolidacion_intentos < :max_intentos
+                  AND EXISTS (SELECT 1 FROM grabaciones_ingesta g WHERE g.evento_id = e.id)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM grabaciones_ingesta g
+                      WHERE g.evento_id = e.id AND g.estado <> 'subido'
+                  )
+                ORDER BY e.id
+                LIMIT :limite
+            """), {"limite": limite, "max_intentos": settings.INGEST_MAX_INTENTOS}).scalars().all()
+        finally:
+            db.close()
+
+        for evento_id in eventos:
+            self.consolidar_evento(evento_id)
+
+    def _leer_evento(self, db: Session, evento_id: int):
+        """Bloquea el evento y retorna (evento, fragmentos); no hace commit"""
+        evento = db.execute(text("""
+            SELECT estado, video_url, video_size_bytes, video_partes
+            FROM eventos_transmision
+            WHERE id = :evento_id
+            FOR UPDATE
+        """), {"evento_id": evento_id}).fetchone()
+
+        # Los nombres de nginx-rtmp llevan timestamp: ordenar por ruta es cronológico.
+        # Si un archivo se registró con otro tamaño/etag, vale el último registro.
+        fragmentos = db.execute(text("""
+            SELECT DISTINCT ON (ruta) r2_key, tamano_bytes, estado
+            FROM grabaciones_ingesta
+            WHERE evento_id = :evento_id
+            ORDER BY ruta, id DESC
+        """), {"evento_id": evento_id}).fetchall()
+
+        return evento, [tuple(f) for f in fragmentos]
+
+    def consolidar_evento(self, evento_id: int):
+        """
+        Une los fragmentos del evento en R2 y enlaza video_url
+
+        Solo un worker por evento: se reclama con pg_try_advisory_lock en una
+        conexión dedicada (en autocommit, sin transacción abierta) durante toda
+        la copia. Si otro ya lo está consolidando, no hace nada.
+        """
+        try:
+            with engine.connect() as conexion:
+                conexion = conexion.execution_options(isolation_level="AUTOCOMMIT")
+                reclamado = conexion.execute(text("""
+                    SELECT pg_try_advisory_lock(hashtext('consolidar_evento'), :evento_id)
+                """), {"evento_id": evento_id}).scalar()
+
+                if not reclamado:
+                    print(f"⏭️ [UPLOAD] Evento #{evento_id}: otro worker ya lo está consolidando")
+                    return
+
+                try:
+                    # Si llegó otro fragmento durante la copia, se vuelve a unir con la lista nueva
+                    for _ in range(3):
+                        if not self._consolidar(evento_id):
+                            break
+                finally:
+                    conexion.execute(text("""
+                        SELECT pg_advisory_unlock(hashtext('consolidar_evento'), :evento_id)
+                    """), {"evento_id": evento_id})
+
+        except Exception as e:
+            print(f"❌ [UPLOAD] Error reclamando la consolidación del evento #{evento_id}: {e}")
+
+    def _consolidar(self, evento_id: int) -> bool:
+        """
+        Una pasada de consolidación; True si los fragmentos cambiaron y hay que repetir
+
+        La copia en R2 puede tardar minutos, así que corre fuera de la
+        transacción: se toma una foto de los fragmentos, se unen, y al volver
+        a bloquear el evento solo se escribe si nada cambió.
+        """
+        db = SessionLocal()
+        try:
+            evento, fragmentos = self._leer_evento(db, evento_id)
+            db.commit()
+
+            if not evento or evento[0] != "finalizado" or not fragmentos:
+                return
+
+            faltantes = [f for f in fragmentos if f[2] != "subido"]
+            if faltantes:
+                print(f"⏳ [UPLOAD] Evento #{evento_id}: {len(faltantes)} fragmentos sin subir, no se consolida aún")
+                return
+
+            destino, tamano_total, tamano_parte = self._destino(evento_id, fragmentos)
+            if destino:
+                video_url = f"{settings.R2_PUBLIC_URL}/{destino}"
+                video_partes = None
+                if evento[1] == video_url and evento[2] == tamano_total:
+                    return
+            else:
+                video_url = None
+                video_partes = [
+                    {"url": f"{settings.R2_PUBLIC_URL}/{r2_key}", "size": tamano}
+                    for r2_key, tamano, _ in fragmentos
+                ]
+                if evento[3] == video_partes:
+                    return
+
+            if destino and len(fragmentos) > 1:
+                print(f"🧵 [UPLOAD] Evento #{evento_id}: uniendo {len(fragmentos)} fragmentos en {destino}")
+                self._unir(fragmentos, destino, tamano_parte)
+
+            evento, fragmentos_ahora = self._leer_evento(db, evento_id)
+            if not evento or evento[0] != "finalizado":
+                db.rollback()
+                return
+            if fragmentos_ahora != fragmentos:
+                print(f"⚠️ [UPLOAD] Evento #{evento_id}: cambiaron los fragmentos durante la unión, se repite")
+                db.rollback()
+                return True
+
+            db.execute(text("""
+                UPDATE eventos_transmision
+                SET video_url = :video_url,
+                    video_size_bytes = :video_size_bytes,
+                    video_partes = CAST(:video_partes AS jsonb),
+                    consolidacion_error = NULL
+                WHERE id = :evento_id
+            """), {
+                "evento_id": evento_id,
+                "video_url": video_url,
+                "video_size_bytes": tamano_total,
+                "video_partes": json.dumps(video_partes) if video_partes else None
+            })
+
+            rollup_service.refrescar_evento(db, evento_id)
+
+            db.commit()
+            if video_url:
+                print(f"✅ [UPLOAD] Evento #{evento_id} enlazado a {video_url}")
+            else:
+                print(f"✅ [UPLOAD] Evento #{evento_id} enlazado a {len(video_partes)} fragmentos en video_partes")
+
+        except Exception as e:
+            db.rollback()
+            print(f"❌ [UPLOAD] Error consolidando evento #{evento_id}: {e}")
+            self._registrar_fallo(db, evento_id, str(e))
+        finally:
+            db.close()
+
+    def _registrar_fallo(self, db: Session, evento_id: int, error: str):
+        """Cuenta el intento fallido: el barrido deja de reintentar al llegar a INGEST_MAX_INTENTOS"""
+        try:
+            intentos = db.execute(text("""
+                UPDATE eventos_transmision
+                SET consolidacion_intentos = consolidacion_intentos + 1,
+                    consolidacion_error = :error
+                WHERE id = :evento_id
+                RETURNING consolidacion_intentos
+            """), {"evento_id": evento_id, "error": error}).scalar()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"❌ [UPLOAD] No se pudo registrar el fallo del evento #{evento_id}: {e}")
+            return
+
+        if intentos and intentos >= settings.INGEST_MAX_INTENTOS:
+            print(f"❌ [UPLOAD] Evento #{evento_id}: {intentos} consolidaciones fallidas, no se reintenta más "
+                  f"(ver eventos_transmision.consolidacion_error)")
+
+    def _destino(self, evento_id: int, fragmentos) -> tuple:
+        """
+        Key final en R2, tamaño total y tamaño de parte para unir
+
+        Con un solo fragmento la key es el mismo objeto y no hay que unir. Si
+        los fragmentos no se pueden unir la key es None y el evento se enlaza
+        a cada fragmento en video_partes.
+        """
+        primero, tamano_primero, _ = fragmentos[0]
+        if len(fragmentos) == 1:
+            return primero, tamano_primero, None
+
+        tamano_total = sum(tamano for _, tamano, _ in fragmentos)
+
+        extension = os.path.splitext(primero)[1].lower()
+        if extension not in settings.get_stitch_extensions():
+            print(f"⚠️ [UPLOAD] Evento #{evento_id}: {extension} no se puede concatenar, "
+                  f"se enlazan los {len(fragmentos)} fragmentos por separado")
+            return None, tamano_total, None
+
+        tamano_parte = self._tamano_parte([tamano for _, tamano, _ in fragmentos])
+        if not tamano_parte:
+            print(f"⚠️ [UPLOAD] Evento #{evento_id}: los fragmentos no se dividen en partes iguales "
+                  f"de 5 MB a 5 GB, se enlazan los {len(fragmentos)} fragmentos por separado")
+            return None, tamano_total, None
+
+        destino = f"{os.path.dirname(primero)}/completo{extension}"
+        return destino, tamano_total, tamano_parte
+
+    def _tamano_parte(self, tamanos: list):
+        """
+        Tamaño de parte con el que se pueden copiar todos los fragmentos, o None
+
+        R2 exige que todas las partes salvo la última midan lo mismo (entre
+        5 MB y 5 GB), así que cada fragmento salvo el último tiene que
+        dividirse exacto en partes de ese tamaño: se busca el mayor divisor
+        común que entre en el rango. El último fragmento puede terminar en una
+        parte más chica.
+        """
+        if any(tamano <= 0 for tamano in tamanos):
+            return None
+
+        comun = 0
+        for tamano in tamanos[:-1]:
+            comun = math.gcd(comun, tamano)
+        if not comun:
+            return None
+
+        # El mayor divisor de `comun` que no pase de MAX_PART_BYTES
+        for divisor in range(math.ceil(comun / MAX_PART_BYTES), comun // MIN_PART_BYTES + 1):
+            if comun % divisor == 0:
+                tamano_parte = comun // divisor
+                break
+        else:
+            return None
+
+        if sum(math.ceil(tamano / tamano_parte) for tamano in tamanos) > MAX_PARTES:
+            return None
+        return tamano_parte
+
+    def _rangos(self, tamano: int, tamano_parte: int) -> list:
+        """Rangos (inicio, fin) inclusivos que cortan un fragmento en partes de `tamano_parte`"""
+        return [
+            (inicio, min(inicio + tamano_parte, tamano) - 1)
+            for inicio in range(0, tamano, tamano_parte)
+        ]
+
+    def _unir(self, fragmentos, destino: str, tamano_parte: int):
+        s3_client = ingest_scheduler.s3_client
+        bucket = settings.R2_BUCKET_NAME
+        extension = os.path.splitext(destino)[1].lower()
+
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket,
+            Key=destino,
+            ContentType=CONTENT_TYPES.get(extension, 'video/mp4')
+        )["UploadId"]
+
+        try:
+            partes = []
+            for r2_key, tamano, _ in fragmentos:
+                for inicio, fin in self._rangos(tamano, tamano_parte):
+                    resultado = s3_client.upload_part_copy(
+                        Bucket=bucket,
+                        Key=destino,
+                        UploadId=upload_id,
+                        PartNumber=len(partes) + 1,
+                        CopySource={"Bucket": bucket, "Key": r2_key},
+                        CopySourceRange=f"bytes={inicio}-{fin}"
+                    )
+                    partes.append({
+                        "ETag": resultado["CopyPartResult"]["ETag"],
+                        "PartNumber": len(partes) + 1
+                    })
+
+            s3_client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=destino,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": partes}
+            )
+        except Exception:
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=destino, UploadId=upload_id)
+            raise
+
+
+# Singleton
+grabaciones_service = GrabacionesService()
@@ -0,0 +1,144 @@
+import threading
+import time
+from datetime import datetime, timezone
+import boto3
+import requests
+from botocore.config import Config
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from app.core.config import settings
+from app.services.cache_bus import cache_bus
+
+
+class HealthService:
+    """
+    Prober en segundo plano para las dependencias del backend
+
+    Cada HEALTH_PROBE_INTERVAL_SECONDS revisa la BD (SELECT 1), R2
+    (head_bucket, solo lectura) y el HLS de Contabo (HEAD). El resultado
+    queda en memoria, así /health/ready responde sin tocar la red.
+    """
+
+    # Sin la BD el backend no puede atender nada
+    CRITICAS = ("database",)
+
+    def __init__(self):
+        self.intervalo = settings.HEALTH_PROBE_INTERVAL_SECONDS
+        self.timeout = settings.HEALTH_PROBE_TIMEOUT_SECONDS
+        self.s3_client = boto3.client(
+            's3',
+            endpoint_url=settings.R2_ENDPOINT,
+            aws_access_key_id=settings.R2_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.R2_SECRET_ACCESS_KEY,
+            region_name='auto',
+            config=Config(
+                connect_timeout=self.timeout,
+                read_timeout=self.timeout,
+                retries={'max_attempts': 1}
+            )
+        )
+        # Conexión nueva en cada chequeo (NullPool) para que connect_timeout
+        # aplique siempre y un socket colgado del pool no bloquee el prober
+        self.engine = create_engine(
+            settings.DATABASE_URL,
+            poolclass=NullPool,
+            connect_args={"connect_timeout": self.timeout}
+        )
+        self._resultados = {}
+        self._ultima_revision = None
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        """Arranca el hilo que revisa las dependencias periódicamente"""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ejecutar, name="health-prober", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def _medir(self, nombre: str, chequeo) -> dict:
+        inicio = time.perf_counter()
+        try:
+            detalle = chequeo()
+            ok = True
+        except Exception as e:
+            detalle = str(e)
+            ok = False
+            print(f"⚠️ [HEALTH] {nombre} no responde: {e}")
+        return {
+            "ok": ok,
+            "latency_ms": round((time.perf_counter() - inicio) * 1000, 2),
+            "detail": detalle,
+            "checked_at": datetime.now(timezone.utc).isoformat()
+        }
+
+    def _chequear_database(self):
+        with self.engine.begin() as conexion:
+            conexion.execute(text(f"SET LOCAL statement_timeout = {int(self.timeout * 1000)}"))
+            conexion.execute(text("SELECT 1"))
+        return None
+
+    def _chequear_r2(self):
+        self.s3_client.head_bucket(Bucket=settings.R2_BUCKET_NAME)
+        return None
+
+    def _chequear_contabo(self):
+        # Un 404 es normal si no hay transmisión: lo que importa es que el VPS responda
+        response = requests.head(f"{settings.HLS_BASE_URL}/stream.m3u8", timeout=self.timeout)
+        if response.status_code >= 500:
+            raise Exception(f"HTTP {response.status_code}")
+        return f"HTTP {response.status_code}"
+
+    def revisar(self):
+        """Ejecuta todos los chequeos y reemplaza el snapshot cacheado"""
+        self._resultados = {
+            "database": self._medir("database", self._chequear_database),
+            "r2": self._medir("r2", self._chequear_r2),
+            "contabo_hls": self._medir("contabo_hls", self._chequear_contabo)
+        }
+        self._ultima_revision = time.monotonic()
+
+    def _ejecutar(self):
+        while not self._detener.is_set():
+            try:
+                self.revisar()
+            except Exception as e:
+                print(f"❌ [HEALTH] Error en el prober: {e}")
+            self._detener.wait(self.intervalo)
+
+    def estado(self) -> dict:
+        """
+        Snapshot cacheado del estado de las dependencias
+
+        status es "ok", "degraded" (falla alguna dependencia no crítica) o
+        "down" (falla una crítica, aún no hay datos, o el snapshot está viejo:
+        si el prober se colgó, no hay forma de saber si la BD responde)
+        """
+        resultados = self._resultados
+        if self._ultima_revision is None:
+            return {"status": "down", "reason": "sin chequeos todavía", "checks": {}}
+
+        edad = time.monotonic() - self._ultima_revision
+        fallidas = [nombre for nombre, r in resultados.items() if not r["ok"]]
+
+        if edad > self.intervalo * 3 or any(nombre in self.CRITICAS for nombre in fallidas):
+            status = "down"
+        elif fallidas:
+            status = "degraded"
+        else:
+            status = "ok"
+
+        return {
+            "status": status,
+            "snapshot_age_s": round(edad, 2),
+            "cache_bus_connected": cache_bus.conectado,
+            "checks": resultados
+        }
+
+
+# Singleton
+health_service = HealthService()
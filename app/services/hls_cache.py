@@ -0,0 +1,156 @@
+import asyncio
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+import requests
+from app.core.config import settings
+
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".aac": "audio/aac",
+}
+
+
+class OrigenError(Exception):
+    """El VPS Contabo respondió con error o no respondió"""
+
+    def __init__(self, status_code: int, mensaje: str):
+        super().__init__(mensaje)
+        self.status_code = status_code
+
+
+class HlsCache:
+    """
+    Origin shield para el HLS de Contabo
+
+    - Playlists (.m3u8): micro-cache de HLS_PLAYLIST_TTL_SECONDS (~1 segmento)
+    - Segmentos (.ts, .m4s, ...): LRU en memoria acotado por HLS_SEGMENT_CACHE_MB
+    - Peticiones concurrentes al mismo objeto comparten una sola descarga
+
+    Todo el estado se modifica desde el event loop, solo la descarga HTTP
+    corre en un hilo, así que no hace falta lock.
+    """
+
+    def __init__(self):
+        self.origen = settings.HLS_BASE_URL.rstrip("/")
+        self.ttl_playlist = settings.HLS_PLAYLIST_TTL_SECONDS
+        self.max_bytes = settings.HLS_SEGMENT_CACHE_MB * 1024 * 1024
+        self._local = threading.local()  # Una requests.Session por hilo de descarga
+        self._playlists = {}  # ruta -> (expira, contenido, content_type)
+        self._segmentos = OrderedDict()  # ruta -> (contenido, content_type)
+        self._bytes = 0
+        self._en_vuelo = {}  # ruta -> asyncio.Task de la descarga
+        self.stats = {"hit": 0, "miss": 0, "coalesced": 0, "origin_errors": 0}
+
+    @staticmethod
+    def content_type(ruta: str) -> str:
+        extension = os.path.splitext(ruta)[1].lower()
+        return CONTENT_TYPES.get(extension) or mimetypes.guess_type(ruta)[0] or "application/octet-stream"
+
+    @staticmethod
+    def es_playlist(ruta: str) -> bool:
+        return ruta.lower().endswith(".m3u8")
+
+    def _session(self) -> requests.Session:
+        # requests.Session no es thread-safe: cada hilo de to_thread usa la suya
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _descargar(self, ruta: str):
+        url = f"{self.origen}/{ruta}"
+        try:
+            response = self._session().get(url, timeout=10)
+        except requests.RequestException as e:
+            raise OrigenError(502, f"Contabo no responde: {e}")
+
+        if response.status_code != 200:
+            raise OrigenError(
+                404 if response.status_code == 404 else 502,
+                f"Contabo respondió HTTP {response.status_code} para {ruta}"
+            )
+
+        return response.content, self.content_type(ruta)
+
+    def _buscar(self, ruta: str):
+        if self.es_playlist(ruta):
+            entrada = self._playlists.get(ruta)
+            if entrada and entrada[0] > time.monotonic():
+                return entrada[1], entrada[2]
+            return None
+
+        entrada = self._segmentos.get(ruta)
+        if entrada:
+            self._segmentos.move_to_end(ruta)
+        return entrada
+
+    def _guardar(self, ruta: str, contenido: bytes, content_type: str):
+        if self.es_playlist(ruta):
+            self._playlists[ruta] = (time.monotonic() + self.ttl_playlist, contenido, content_type)
+            return
+
+        # Un segmento enorme vaciaría el LRU entero: no se cachea
+        if len(contenido) > self.max_bytes // 4 or ruta in self._segmentos:
+            return
+
+        self._segmentos[ruta] = (contenido, content_type)
+        self._bytes += len(contenido)
+        while self._bytes > self.max_bytes:
+            _, (viejo, _) = self._segmentos.popitem(last=False)
+            self._bytes -= len(viejo)
+
+    async def obtener(self, ruta: str):
+        """
+        Devuelve (contenido, content_type, estado_cache) para una ruta HLS
+
+        estado_cache es "HIT", "MISS" o "COALESCED". Lanza OrigenError si
+        Contabo falla.
+        """
+        entrada = self._buscar(ruta)
+        if entrada:
+            self.stats["hit"] += 1
+            return entrada[0], entrada[1], "HIT"
+
+        if ruta in self._en_vuelo:
+            self.stats["coalesced"] += 1
+            estado_cache = "COALESCED"
+        else:
+            self.stats["miss"] += 1
+            estado_cache = "MISS"
+            # La descarga es una tarea propia: si el cliente que la inició se
+            # desconecta, los demás que esperan igual reciben el objeto
+            tarea = asyncio.ensure_future(self._descargar_y_guardar(ruta))
+            tarea.add_done_callback(lambda t: self._fin_descarga(ruta, t))
+            self._en_vuelo[ruta] = tarea
+
+        contenido, content_type = await asyncio.shield(self._en_vuelo[ruta])
+        return contenido, content_type, estado_cache
+
+    async def _descargar_y_guardar(self, ruta: str):
+        contenido, content_type = await asyncio.to_thread(self._descargar, ruta)
+        self._guardar(ruta, contenido, content_type)
+        return contenido, content_type
+
+    def _fin_descarga(self, ruta: str, tarea: asyncio.Task):
+        self._en_vuelo.pop(ruta, None)
+        if not tarea.cancelled() and tarea.exception() is not None:
+            self.stats["origin_errors"] += 1
+
+    def estado(self) -> dict:
+        return {
+            **self.stats,
+            "playlists": len(self._playlists),
+            "segments": len(self._segmentos),
+            "segment_bytes": self._bytes,
+            "segment_bytes_max": self.max_bytes
+        }
+
+
+# Singleton
+hls_cache = HlsCache()
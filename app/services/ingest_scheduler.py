@@ -0,0 +1,521 @@
+import os
+import threading
+import time
+from datetime import datetime
+import boto3
+import requests
+from sqlalchemy import text
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+from app.services.cache_bus import cache_bus
+
+CHUNK_BYTES = 64 * 1024
+
+# Cada cuánto una transferencia activa marca su fila como viva
+LATIDO_SEGUNDOS = 30
+
+CONTENT_TYPES = {
+    ".mp4": "video/mp4",
+    ".flv": "video/x-flv",
+    ".ts": "video/mp2t",
+}
+
+
+class TrabajoPerdido(Exception):
+    """La fila fue devuelta a la cola y otro worker la reclamó: se aborta la transferencia"""
+
+
+class TransferenciaDetenida(Exception):
+    """El worker se está apagando: la fila vuelve a la cola para otro worker"""
+
+
+class PresupuestoGlobal:
+    """
+    Límite de bytes/seg compartido por todos los procesos vía Postgres
+
+    El presupuesto de cada segundo vive en la tabla ingest_ancho_banda: cada
+    proceso pide cupos de ~1/10 de la tasa con un UPSERT que solo suma si no
+    se pasa del límite, así N workers juntos nunca superan la tasa configurada
+    y uno solo puede usarla completa si es el único transfiriendo.
+
+    Dentro del proceso los turnos se atienden en orden de llegada (tickets), y
+    cada transferencia pide de a CHUNK_BYTES, así el cupo se reparte por igual
+    entre las grabaciones activas. La tasa se consulta en cada pedido, de modo
+    que un cambio de límite (p. ej. empieza un evento en vivo) aplica enseguida.
+    """
+
+    def __init__(self, tasa):
+        self.tasa = tasa  # Callable -> bytes/seg; 0 = sin límite
+        self._saldo = 0  # Solo lo toca quien tiene el turno
+        self._cond = threading.Condition()
+        self._siguiente_ticket = 0
+        self._turno = 0
+
+    def _pedir_cupo(self, cupo: int, tasa: float) -> bool:
+        with engine.begin() as conexion:
+            fila = conexion.execute(text("""
+                INSERT INTO ingest_ancho_banda (segundo, bytes)
+                VALUES (floor(extract(epoch FROM clock_timestamp()))::bigint, :cupo)
+                ON CONFLICT (segundo) DO UPDATE
+                    SET bytes = ingest_ancho_banda.bytes + EXCLUDED.bytes
+                    WHERE ingest_ancho_banda.bytes + EXCLUDED.bytes <= :tasa
+                RETURNING bytes
+            """), {"cupo": cupo, "tasa": int(tasa)}).fetchone()
+        return fila is not None
+
+    def consumir(self, n: int):
+        """Bloquea hasta que haya presupuesto para n bytes"""
+        with self._cond:
+            ticket = self._siguiente_ticket
+            self._siguiente_ticket += 1
+            while ticket != self._turno:
+                self._cond.wait()
+
+        try:
+            while self._saldo < n:
+                tasa = self.tasa()
+                if tasa <= 0:
+                    return
+                cupo = int(min(tasa, max(CHUNK_BYTES, tasa // 10)))
+                try:
+                    concedido = self._pedir_cupo(cupo, tasa)
+                except Exception as e:
+                    # Sin BD no hay presupuesto compartido: se limita solo este proceso
+                    print(f"⚠️ [INGEST] No se pudo pedir cupo de ancho de banda: {e}")
+                    time.sleep(cupo / tasa)
+                    concedido = True
+
+                if concedido:
+                    self._saldo += cupo
+                else:
+                    # El cupo de este segundo ya se repartió entre los workers
+                    time.sleep(max(1 - time.time() % 1, 0.05))
+            self._saldo -= n
+        finally:
+            with self._cond:
+                self._turno += 1
+                self._cond.notify_all()
+
+
+class LectorLimitado:
+    """File-like de solo lectura que pasa cada bloque por el presupuesto global"""
+
+    def __init__(self, raw, presupuesto: PresupuestoGlobal, trabajo: "TrabajoIngesta", latido,
+                 detener: threading.Event):
+        self.raw = raw
+        self.presupuesto = presupuesto
+        self.trabajo = trabajo
+        self.latido = latido  # Callable(trabajo), cada LATIDO_SEGUNDOS
+        self.detener = detener
+        self._ultimo_latido = time.monotonic()
+
+    def read(self, size: int = -1) -> bytes:
+        # s3transfer espera bloques completos: solo devuelve menos al llegar al final
+        partes = []
+        restante = size if size and size > 0 else None
+        while restante is None or restante > 0:
+            if self.detener.is_set():
+                # s3transfer aborta el multipart al recibir la excepción
+                raise TransferenciaDetenida(f"Transferencia de la grabación #{self.trabajo.id} detenida")
+
+            if time.monotonic() - self._ultimo_latido > LATIDO_SEGUNDOS:
+                self.latido(self.trabajo)
+                self._ultimo_latido = time.monotonic()
+
+            pedir = CHUNK_BYTES if restante is None else min(CHUNK_BYTES, restante)
+            self.presupuesto.consumir(pedir)
+            bloque = self.raw.read(pedir)
+            if not bloque:
+                break
+            partes.append(bloque)
+            self.trabajo.bytes_transferidos += len(bloque)
+            if restante is not None:
+                restante -= len(bloque)
+        return b"".join(partes)
+
+
+class TrabajoIngesta:
+    """Una fila de grabaciones_ingesta reclamada por este worker"""
+
+    def __init__(self, grabacion_id: int, path: str, stream_key: str, r2_key: str,
+                 prioridad: int, evento_id, intento: int, total_bytes: int = None):
+        self.id = grabacion_id
+        self.path = path
+        self.stream_key = stream_key
+        self.r2_key = r2_key
+        self.prioridad = prioridad
+        self.evento_id = evento_id
+        self.intento = intento  # Valor de `intentos` al reclamar: identifica este reclamo
+        self.estado = "transfiriendo"
+        self.bytes_transferidos = 0
+        self.total_bytes = total_bytes
+        self.iniciado_en = datetime.now()
+
+    def a_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "path": self.path,
+            "r2_key": self.r2_key,
+            "prioridad": self.prioridad,
+            "evento_id": self.evento_id,
+            "intento": self.intento,
+            "estado": self.estado,
+            "bytes_transferidos": self.bytes_transferidos,
+            "total_bytes": self.total_bytes,
+            "iniciado_en": self.iniciado_en.isoformat()
+        }
+
+
+class IngestScheduler:
+    """
+    Cola persistente de subidas Contabo -> R2 con límite global de ancho de banda
+
+    La cola es la tabla grabaciones_ingesta, así sobrevive a redeploys y la
+    comparten todos los workers. Cada hilo reclama la siguiente fila
+    'pendiente' con FOR UPDATE SKIP LOCKED (menor `prioridad` primero; a igual
+    prioridad, orden de llegada) y mientras transfiere renueva actualizado_en
+    cada LATIDO_SEGUNDOS. Si el worker muere, la fila queda en 'transfiriendo'
+    sin latidos y el barrido la devuelve a 'pendiente'.
+
+    - Sin eventos en vivo: INGEST_MAX_BYTES_PER_SEC (0 = velocidad completa)
+    - Con algún evento 'en_vivo': INGEST_LIVE_BYTES_PER_SEC, para no competir
+      con los viewers HLS por el uplink de Contabo
+    Ambos límites son el total de todos los workers (ver PresupuestoGlobal).
+    """
+
+    def __init__(self):
+        self.s3_client = boto3.client(
+            's3',
+            endpoint_url=settings.R2_ENDPOINT,
+            aws_access_key_id=settings.R2_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.R2_SECRET_ACCESS_KEY,
+            region_name='auto'
+        )
+        self.presupuesto = PresupuestoGlobal(self.tasa_actual)
+        self.al_completar = None  # Callable(trabajo), tras marcar la fila como 'subido'
+        self.al_barrer = None  # Callable(), al final de cada barrido
+        self._activos = {}
+        self._cond = threading.Condition()
+        self._hilos = []
+        self._detener = threading.Event()
+        self._en_vivo = False
+        self._en_vivo_revisado = 0.0
+        self._en_vivo_lock = threading.Lock()
+
+    def iniciar(self):
+        """Arranca el barrido de trabajos colgados y los hilos que procesan la cola"""
+        if self._hilos:
+            return
+        hilo = threading.Thread(target=self._barrer_periodicamente, name="ingest-barrido", daemon=True)
+        hilo.start()
+        self._hilos.append(hilo)
+        for i in range(max(settings.INGEST_MAX_CONCURRENT, 1)):
+            hilo = threading.Thread(target=self._ejecutar, name=f"ingest-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def detener(self, espera: float = 5):
+        """
+        Detiene este worker y devuelve sus grabaciones en curso a la cola
+
+        Las transferencias se cortan en el siguiente bloque y cada hilo deja su
+        fila en 'pendiente'; lo que no alcanza a cortarse en `espera` segundos
+        se devuelve desde acá. Así otro worker la retoma enseguida, sin esperar
+        INGEST_STALE_MINUTES al barrido.
+        """
+        self._detener.set()
+        self.despertar()
+
+        limite = time.monotonic() + espera
+        for hilo in self._hilos:
+            hilo.join(max(limite - time.monotonic(), 0))
+
+        for trabajo in list(self._activos.values()):
+            self._devolver(trabajo)
+
+    def despertar(self):
+        """Avisa a los hilos de este worker que hay filas nuevas en la cola"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def hay_evento_en_vivo(self) -> bool:
+        """
+        Indica si hay algún evento 'en_vivo'
+
+        Se guarda en el cache "live" del bus, que /start y /stop invalidan en
+        todos los workers; como respaldo se consulta la BD como máximo 1 vez/seg.
+        """
+        valor = cache_bus.live.obtener("hay_en_vivo")
+        if valor is not None:
+            return valor
+
+        with self._en_vivo_lock:
+            if time.monotonic() - self._en_vivo_revisado < 1:
+                return self._en_vivo
+
+            generacion = cache_bus.live.generacion()
+            db = SessionLocal()
+            try:
+                self._en_vivo = bool(db.execute(text("""
+                    SELECT EXISTS(SELECT 1 FROM eventos_transmision WHERE estado = 'en_vivo')
+                """)).scalar())
+            except Exception as e:
+                print(f"⚠️ [INGEST] No se pudo consultar eventos en vivo: {e}")
+                self._en_vivo = True  # Ante la duda, proteger a los viewers
+            finally:
+                db.close()
+
+            self._en_vivo_revisado = time.monotonic()
+            cache_bus.live.guardar("hay_en_vivo", self._en_vivo, generacion)
+            return self._en_vivo
+
+    def tasa_actual(self) -> float:
+        """Bytes/seg permitidos ahora mismo entre todos los workers (0 = sin límite)"""
+        tasa = settings.INGEST_MAX_BYTES_PER_SEC
+        if self.hay_evento_en_vivo() and settings.INGEST_LIVE_BYTES_PER_SEC > 0:
+            tasa = min(tasa, settings.INGEST_LIVE_BYTES_PER_SEC) if tasa > 0 else settings.INGEST_LIVE_BYTES_PER_SEC
+        return tasa
+
+    def _reclamar(self):
+        """Toma la siguiente grabación pendiente, o None si la cola está vacía"""
+        with engine.begin() as conexion:
+            fila = conexion.execute(text("""
+                UPDATE grabaciones_ingesta
+                SET estado = 'transfiriendo',
+                    intentos = intentos + 1,
+                    bytes_transferidos = 0,
+                    error = NULL,
+                    actualizado_en = NOW()
+                WHERE id = (
+                    SELECT id FROM grabaciones_ingesta
+                    WHERE estado = 'pendiente'
+                    ORDER BY prioridad, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, ruta, stream_key, r2_key, prioridad, evento_id, intentos, tamano_bytes
+            """)).fetchone()
+
+        if not fila:
+            return None
+
+        return TrabajoIngesta(
+            fila[0], fila[1], fila[2], fila[3], fila[4], fila[5], fila[6],
+            total_bytes=fila[7] or None
+        )
+
+    def _ejecutar(self):
+        while not self._detener.is_set():
+            try:
+                trabajo = self._reclamar()
+            except Exception as e:
+                print(f"❌ [INGEST] Error reclamando grabación: {e}")
+                trabajo = None
+
+            if trabajo is None:
+                # Otro worker pudo encolar: se revisa la tabla igual cada 5 s
+                with self._cond:
+                    self._cond.wait(5)
+                continue
+
+            self._transferir(trabajo)
+
+    def _latido(self, trabajo: TrabajoIngesta):
+        with engine.begin() as conexion:
+            resultado = conexion.execute(text("""
+                UPDATE grabaciones_ingesta
+                SET actualizado_en = NOW(), bytes_transferidos = :bytes
+                WHERE id = :id AND estado = 'transfiriendo' AND intentos = :intento
+            """), {"id": trabajo.id, "intento": trabajo.intento, "bytes": trabajo.bytes_transferidos})
+        if resultado.rowcount == 0:
+            raise TrabajoPerdido(f"La grabación #{trabajo.id} ya no pertenece a este worker")
+
+    def _devolver(self, trabajo: TrabajoIngesta):
+        """Vuelve a poner la fila en 'pendiente' si sigue siendo de este reclamo"""
+        try:
+            with engine.begin() as conexion:
+                resultado = conexion.execute(text("""
+                    UPDATE grabaciones_ingesta
+                    SET estado = 'pendiente', bytes_transferidos = 0, actualizado_en = NOW()
+                    WHERE id = :id AND estado = 'transfiriendo' AND intentos = :intento
+                """), {"id": trabajo.id, "intento": trabajo.intento})
+            if resultado.rowcount:
+                print(f"↩️ [INGEST] #{trabajo.id} devuelta a la cola")
+        except Exception as e:
+            # Si no se pudo, el barrido la recupera pasado INGEST_STALE_MINUTES
+            print(f"❌ [INGEST] #{trabajo.id} no se pudo devolver a la cola: {e}")
+        finally:
+            self._activos.pop(trabajo.id, None)
+
+    def _terminar(self, trabajo: TrabajoIngesta, error: str = None) -> bool:
+        """Marca la fila como 'subido' o 'error'; False si el reclamo ya no es de este worker"""
+        with engine.begin() as conexion:
+            resultado = conexion.execute(text("""
+                UPDATE grabaciones_ingesta
+                SET estado = :estado,
+                    error = :error,
+                    bytes_transferidos = :bytes,
+                    actualizado_en = NOW()
+                WHERE id = :id AND estado = 'transfiriendo' AND intentos = :intento
+            """), {
+                "id": trabajo.id,
+                "intento": trabajo.intento,
+                "estado": "error" if error else "subido",
+                "error": error,
+                "bytes": trabajo.bytes_transferidos
+            })
+        return resultado.rowcount == 1
+
+    def _transferir(self, trabajo: TrabajoIngesta):
+        self._activos[trabajo.id] = trabajo
+        error = None
+        try:
+            # path = /var/www/recordings/stream-20250103-194530.mp4
+            # URL = http://185.188.249.229/recordings/stream-20250103-194530.mp4
+            filename_only = os.path.basename(trabajo.path)
+            extension = os.path.splitext(filename_only)[1].lower() or ".mp4"
+            video_url_contabo = f"http://{settings.CONTABO_IP}/recordings/{filename_only}"
+
+            print(f"📹 [INGEST] #{trabajo.id} (intento {trabajo.intento}) descargando desde Contabo: {video_url_contabo}")
+
+            with requests.get(video_url_contabo, stream=True, timeout=(10, 300)) as response:
+                if response.status_code != 200:
+                    raise Exception(f"Error descargando video de Contabo: HTTP {response.status_code}")
+
+                if response.headers.get("Content-Length"):
+                    trabajo.total_bytes = int(response.headers["Content-Length"])
+
+                print(f"☁️ [INGEST] #{trabajo.id} subiendo a R2: {trabajo.r2_key}")
+
+                self.s3_client.upload_fileobj(
+                    LectorLimitado(response.raw, self.presupuesto, trabajo, self._latido, self._detener),
+                    settings.R2_BUCKET_NAME,
+                    trabajo.r2_key,
+                    ExtraArgs={'ContentType': CONTENT_TYPES.get(extension, 'video/mp4')}
+                )
+
+            video_size_mb = trabajo.bytes_transferidos / (1024 * 1024)
+            print(f"✅ [INGEST] #{trabajo.id} video subido a R2 ({video_size_mb:.2f} MB): {trabajo.r2_key}")
+
+        except TrabajoPerdido as e:
+            print(f"⚠️ [INGEST] {e}, se abandona la transferencia")
+            self._activos.pop(trabajo.id, None)
+            return
+
+        except TransferenciaDetenida as e:
+            print(f"🛑 [INGEST] {e}")
+            self._devolver(trabajo)
+            return
+
+        except Exception as e:
+            error = str(e)
+            print(f"❌ [INGEST] #{trabajo.id} error subiendo grabación: {e}")
+
+        trabajo.estado = "error" if error else "subido"
+        try:
+            vigente = self._terminar(trabajo, error)
+        except Exception as e:
+            # La fila sigue en 'transfiriendo' y el barrido la devolverá a la cola
+            print(f"❌ [INGEST] #{trabajo.id} no se pudo guardar su estado: {e}")
+            vigente = False
+        finally:
+            self._activos.pop(trabajo.id, None)
+
+        if vigente and not error and self.al_completar:
+            try:
+                self.al_completar(trabajo)
+            except Exception as e:
+                print(f"❌ [INGEST] #{trabajo.id} error en al_completar: {e}")
+
+    def barrer(self):
+        """
+        Devuelve a la cola las transferencias colgadas o fallidas y limpia el presupuesto viejo
+
+        - 'transfiriendo' sin latidos por más de INGEST_STALE_MINUTES: su
+          worker murió o fue redeployado
+        - 'error' con menos de INGEST_MAX_INTENTOS intentos, pasados
+          INGEST_RETRY_MINUTES desde el último
+        """
+        with engine.begin() as conexion:
+            recuperadas = conexion.execute(text("""
+                UPDATE grabaciones_ingesta
+                SET estado = 'pendiente', actualizado_en = NOW()
+                WHERE (estado = 'transfiriendo'
+                       AND actualizado_en < NOW() - make_interval(mins => :stale_min))
+                   OR (estado = 'error'
+                       AND intentos < :max_intentos
+                       AND actualizado_en < NOW() - make_interval(mins => :retry_min))
+                RETURNING id
+            """), {
+                "stale_min": settings.INGEST_STALE_MINUTES,
+                "max_intentos": settings.INGEST_MAX_INTENTOS,
+                "retry_min": settings.INGEST_RETRY_MINUTES
+            }).scalars().all()
+
+            conexion.execute(text("""
+                DELETE FROM ingest_ancho_banda
+                WHERE segundo < floor(extract(epoch FROM clock_timestamp()))::bigint - 60
+            """))
+
+        if recuperadas:
+            print(f"♻️ [INGEST] {len(recuperadas)} grabaciones vuelven a la cola: {recuperadas}")
+            self.despertar()
+
+        if self.al_barrer:
+            self.al_barrer()
+
+    def _barrer_periodicamente(self):
+        # La primera pasada, al arrancar, recupera lo que dejó el deploy anterior
+        while not self._detener.is_set():
+            try:
+                self.barrer()
+            except Exception as e:
+                print(f"❌ [INGEST] Error en el barrido: {e}")
+            self._detener.wait(60)
+
+    def estado(self) -> dict:
+        db = SessionLocal()
+        try:
+            por_estado = db.execute(text("""
+                SELECT estado, COUNT(*), COALESCE(SUM(tamano_bytes), 0)
+                FROM grabaciones_ingesta
+                GROUP BY estado
+            """)).fetchall()
+
+            recientes = db.execute(text("""
+                SELECT id, ruta, estado, prioridad, intentos, bytes_transferidos,
+                       tamano_bytes, error, actualizado_en
+                FROM grabaciones_ingesta
+                ORDER BY actualizado_en DESC
+                LIMIT 20
+            """)).fetchall()
+        finally:
+            db.close()
+
+        return {
+            "hay_evento_en_vivo": self.hay_evento_en_vivo(),
+            "tasa_bytes_por_seg": self.tasa_actual(),
+            "cola": {
+                row[0]: {"grabaciones": row[1], "bytes": row[2]}
+                for row in por_estado
+            },
+            "activos_en_este_worker": [t.a_dict() for t in list(self._activos.values())],
+            "recientes": [
+                {
+                    "id": row[0],
+                    "ruta": row[1],
+                    "estado": row[2],
+                    "prioridad": row[3],
+                    "intentos": row[4],
+                    "bytes_transferidos": row[5],
+                    "tamano_bytes": row[6],
+                    "error": row[7],
+                    "actualizado_en": row[8].isoformat() if row[8] else None
+                }
+                for row in recientes
+            ]
+        }
+
+
+# Singleton
+ingest_scheduler = IngestScheduler()
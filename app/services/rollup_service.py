@@ -0,0 +1,125 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+class RollupService:
+    """
+    Mantiene las tablas de resumen eventos_resumen y eventos_resumen_mensual
+
+    Los dashboards leen solo estas tablas. Se refrescan de forma incremental:
+    una fila por evento (buscada por PK) y luego solo el mes afectado.
+    Los métodos no hacen commit, corren dentro de la transacción del caller.
+    """
+
+    def _upsert_resumenes(self, db: Session, filtro: str, params: dict) -> list:
+        """Inserta o actualiza eventos_resumen para los eventos que cumplen `filtro`; retorna sus meses"""
+        return db.execute(text(f"""
+            INSERT INTO eventos_resumen (
+                evento_id, mes, titulo, fecha_evento, fecha_fin_evento,
+                duracion_segundos, video_url, video_size_bytes,
+                viewer_count_max, total_views, actualizado_en
+            )
+            SELECT
+                id,
+                date_trunc('month', fecha_evento)::date,
+                titulo,
+                fecha_evento,
+                fecha_fin_evento,
+                CASE WHEN fecha_fin_evento IS NOT NULL
+                     THEN GREATEST(EXTRACT(EPOCH FROM fecha_fin_evento - fecha_evento), 0)::integer
+                END,
+                video_url,
+                video_size_bytes,
+                COALESCE(viewer_count_max, 0),
+                COALESCE(total_views, 0),
+                NOW()
+            FROM eventos_transmision
+            WHERE {filtro} AND fecha_evento IS NOT NULL
+            ON CONFLICT (evento_id) DO UPDATE SET
+                mes = EXCLUDED.mes,
+                titulo = EXCLUDED.titulo,
+                fecha_evento = EXCLUDED.fecha_evento,
+                fecha_fin_evento = EXCLUDED.fecha_fin_evento,
+                duracion_segundos = EXCLUDED.duracion_segundos,
+                video_url = EXCLUDED.video_url,
+                video_size_bytes = EXCLUDED.video_size_bytes,
+                viewer_count_max = EXCLUDED.viewer_count_max,
+                total_views = EXCLUDED.total_views,
+                actualizado_en = EXCLUDED.actualizado_en
+            RETURNING mes
+        """), params).scalars().all()
+
+    def refrescar_evento(self, db: Session, evento_id: int):
+        """Recalcula el resumen de un evento y el de su mes"""
+        mes_anterior = db.execute(text("""
+            SELECT mes FROM eventos_resumen WHERE evento_id = :evento_id
+        """), {"evento_id": evento_id}).scalar()
+
+        meses = self._upsert_resumenes(db, "id = :evento_id", {"evento_id": evento_id})
+
+        # Si cambió la fecha del evento, el mes anterior también pierde una fila.
+        # Orden fijo para que dos transacciones no tomen los locks cruzados.
+        for m in sorted((set(meses) | {mes_anterior}) - {None}):
+            self._refrescar_mes(db, m)
+
+    def _refrescar_mes(self, db: Session, mes):
+        # Serializa el recálculo por mes hasta el fin de la transacción: el
+        # siguiente en tomar el lock ve el eventos_resumen ya commiteado del
+        # anterior y no lo pisa con un conteo incompleto
+        db.execute(text("""
+            SELECT pg_advisory_xact_lock(hashtext('eventos_resumen_mensual:' || CAST(:mes AS text)))
+        """), {"mes": mes})
+
+        db.execute(text("""
+            INSERT INTO eventos_resumen_mensual (
+                mes, total_eventos, duracion_total_segundos, duracion_promedio_segundos,
+                video_bytes_total, viewer_count_max, total_views, actualizado_en
+            )
+            SELECT
+                :mes,
+                COUNT(*),
+                COALESCE(SUM(duracion_segundos), 0),
+                AVG(duracion_segundos)::integer,
+                COALESCE(SUM(video_size_bytes), 0),
+                COALESCE(MAX(viewer_count_max), 0),
+                COALESCE(SUM(total_views), 0),
+                NOW()
+            FROM eventos_resumen
+            WHERE mes = :mes
+            ON CONFLICT (mes) DO UPDATE SET
+                total_eventos = EXCLUDED.total_eventos,
+                duracion_total_segundos = EXCLUDED.duracion_total_segundos,
+                duracion_promedio_segundos = EXCLUDED.duracion_promedio_segundos,
+                video_bytes_total = EXCLUDED.video_bytes_total,
+                viewer_count_max = EXCLUDED.viewer_count_max,
+                total_views = EXCLUDED.total_views,
+                actualizado_en = EXCLUDED.actualizado_en
+        """), {"mes": mes})
+
+        db.execute(text("""
+            DELETE FROM eventos_resumen_mensual
+            WHERE mes = :mes AND total_eventos = 0
+        """), {"mes": mes})
+
+    def reconstruir(self, db: Session) -> int:
+        """
+        Recalcula todos los resúmenes de eventos finalizados
+
+        Un solo INSERT ... SELECT para eventos_resumen y luego un recálculo
+        por mes. Pensado para la carga inicial, no para llamarse de forma
+        frecuente. Retorna la cantidad de eventos procesados.
+        """
+        meses_anteriores = db.execute(text("""
+            SELECT DISTINCT mes FROM eventos_resumen
+        """)).scalars().all()
+
+        meses = self._upsert_resumenes(db, "estado = 'finalizado'", {})
+
+        for m in sorted((set(meses) | set(meses_anteriores)) - {None}):
+            self._refrescar_mes(db, m)
+
+        return len(meses)
+
+
+# Singleton
+rollup_service = RollupService()
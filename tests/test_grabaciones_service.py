@@ -0,0 +1,89 @@
+import pytest
+from app.services.grabaciones_service import (
+    GrabacionesService, MAX_PART_BYTES, MAX_PARTES, MIN_PART_BYTES
+)
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+
+@pytest.fixture
+def servicio():
+    return GrabacionesService()
+
+
+def fragmentos(*tamanos, extension=".ts"):
+    return [
+        (f"streams/abc/7/stream-{i}{extension}", tamano, "subido")
+        for i, tamano in enumerate(tamanos)
+    ]
+
+
+def partes(servicio, tamanos, tamano_parte):
+    """Tamaño de cada parte del multipart, en el orden en que se copian"""
+    return [
+        fin - inicio + 1
+        for tamano in tamanos
+        for inicio, fin in servicio._rangos(tamano, tamano_parte)
+    ]
+
+
+def assert_partes_validas(servicio, tamanos, tamano_parte):
+    resultado = partes(servicio, tamanos, tamano_parte)
+    assert sum(resultado) == sum(tamanos)
+    assert len(resultado) <= MAX_PARTES
+    # R2: todas las partes salvo la última iguales y entre 5 MB y 5 GB
+    assert len(set(resultado[:-1])) <= 1
+    assert all(MIN_PART_BYTES <= p <= MAX_PART_BYTES for p in resultado[:-1])
+
+
+def test_rangos_cubren_el_fragmento_sin_huecos(servicio):
+    assert servicio._rangos(25 * MB, 10 * MB) == [
+        (0, 10 * MB - 1),
+        (10 * MB, 20 * MB - 1),
+        (20 * MB, 25 * MB - 1),
+    ]
+    assert servicio._rangos(1, 10 * MB) == [(0, 0)]
+
+
+@pytest.mark.parametrize("tamanos", [
+    [10 * MB, 10 * MB, 3 * MB],
+    [10 * MB, 15 * MB, 1],
+    [6 * GB, 6 * GB, 1 * MB],
+    [10 * MB + 1, 10 * MB + 1, 7 * GB],
+])
+def test_tamano_parte_da_partes_iguales(servicio, tamanos):
+    tamano_parte = servicio._tamano_parte(tamanos)
+    assert tamano_parte is not None
+    assert_partes_validas(servicio, tamanos, tamano_parte)
+
+
+@pytest.mark.parametrize("tamanos", [
+    [6 * MB, 9 * MB, 1],  # Máximo común de 3 MB: partes menores al mínimo
+    [4 * MB, 4 * MB, 1 * MB],  # Fragmentos intermedios menores a 5 MB
+    [10 * MB, 0, 1 * MB],  # Fragmento sin tamaño
+    [10 * MB, 10 * MB, 0],
+    [5 * MB] * 2 + [MAX_PARTES * 5 * MB],  # Más de 10.000 partes
+])
+def test_tamano_parte_rechaza_fragmentos_que_no_se_pueden_unir(servicio, tamanos):
+    assert servicio._tamano_parte(tamanos) is None
+
+
+def test_destino_un_fragmento_es_el_mismo_objeto(servicio):
+    assert servicio._destino(7, fragmentos(3 * MB)) == ("streams/abc/7/stream-0.ts", 3 * MB, None)
+
+
+def test_destino_une_fragmentos_compatibles(servicio):
+    destino, total, tamano_parte = servicio._destino(7, fragmentos(10 * MB, 10 * MB, 3 * MB))
+    assert destino == "streams/abc/7/completo.ts"
+    assert total == 23 * MB
+    assert tamano_parte == 10 * MB
+
+
+def test_destino_sin_unir_si_las_partes_no_serian_iguales(servicio):
+    assert servicio._destino(7, fragmentos(6 * MB, 9 * MB, 1)) == (None, 15 * MB + 1, None)
+
+
+def test_destino_sin_unir_si_el_formato_no_se_concatena(servicio):
+    # nginx-rtmp `record` escribe .flv: por defecto no se une
+    assert servicio._destino(7, fragmentos(10 * MB, 10 * MB, extension=".flv")) == (None, 20 * MB, None)
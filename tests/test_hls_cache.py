@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app.services.hls_cache import HlsCache, OrigenError
+
+OBJETOS = {
+    "/stream.m3u8": b"#EXTM3U\n#EXT-X-TARGETDURATION:2\nseg-1.ts\n",
+    "/seg-1.ts": b"1" * 1000,
+    "/seg-2.ts": b"2" * 1000,
+    "/seg-3.ts": b"3" * 1000,
+    "/seg-4.ts": b"4" * 1000,
+    "/seg-5.ts": b"5" * 1000,
+}
+
+
+@pytest.fixture
+def origen():
+    """Stand-in local de Contabo que cuenta cuántas veces se pide cada ruta"""
+    pedidos = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            pedidos[self.path] = pedidos.get(self.path, 0) + 1
+            time.sleep(0.1)  # Da tiempo a que lleguen peticiones concurrentes
+            contenido = OBJETOS.get(self.path)
+            if contenido is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(contenido)))
+            self.end_headers()
+            self.wfile.write(contenido)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{servidor.server_port}", pedidos
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def cache(origen):
+    url, _ = origen
+    cache = HlsCache()
+    cache.origen = url
+    return cache
+
+
+def test_peticiones_concurrentes_comparten_una_descarga(cache, origen):
+    _, pedidos = origen
+
+    async def pedir():
+        return await asyncio.gather(*[cache.obtener("seg-1.ts") for _ in range(20)])
+
+    resultados = asyncio.run(pedir())
+
+    assert pedidos["/seg-1.ts"] == 1
+    assert sorted({r[2] for r in resultados}) == ["COALESCED", "MISS"]
+    assert all(r[0] is resultados[0][0] for r in resultados)
+    assert cache.stats["coalesced"] == 19
+
+
+def test_playlist_se_cachea_solo_durante_el_ttl(cache, origen):
+    _, pedidos = origen
+    cache.ttl_playlist = 0.2
+
+    async def pedir():
+        primero = await cache.obtener("stream.m3u8")
+        segundo = await cache.obtener("stream.m3u8")
+        await asyncio.sleep(0.3)
+        tercero = await cache.obtener("stream.m3u8")
+        return primero, segundo, tercero
+
+    primero, segundo, tercero = asyncio.run(pedir())
+
+    assert [primero[2], segundo[2], tercero[2]] == ["MISS", "HIT", "MISS"]
+    assert primero[1] == "application/vnd.apple.mpegurl"
+    assert pedidos["/stream.m3u8"] == 2
+
+
+def test_lru_expulsa_el_segmento_menos_usado(cache, origen):
+    _, pedidos = origen
+    cache.max_bytes = 4000  # Caben 4 segmentos de 1000
+
+    async def pedir():
+        for n in (1, 2, 3, 4):
+            await cache.obtener(f"seg-{n}.ts")
+        await cache.obtener("seg-1.ts")  # seg-1 pasa a ser el más reciente
+        await cache.obtener("seg-5.ts")  # Expulsa seg-2, el menos usado
+        return await cache.obtener("seg-1.ts"), await cache.obtener("seg-2.ts")
+
+    seg_1, seg_2 = asyncio.run(pedir())
+
+    assert seg_1[2] == "HIT"
+    assert seg_2[2] == "MISS"
+    assert pedidos["/seg-1.ts"] == 1
+    assert pedidos["/seg-2.ts"] == 2
+    assert cache.estado()["segment_bytes"] <= 4000
+
+
+def test_404_del_origen_no_se_cachea(cache, origen):
+    _, pedidos = origen
+
+    async def pedir():
+        for _ in range(2):
+            with pytest.raises(OrigenError) as error:
+                await cache.obtener("no-existe.ts")
+            assert error.value.status_code == 404
+
+    asyncio.run(pedir())
+
+    assert pedidos["/no-existe.ts"] == 2
+    assert cache.stats["origin_errors"] == 2